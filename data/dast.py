@@ -7,6 +7,7 @@ Main classes, methods and functions:
 - DAST - main class implementing DAST language
 - DAST.dump() - serialize an object into a DAST stream
 - DAST.load() - decode a DAST stream and yield consecutive deserialized objects
+  (optionally: in parallel, workers=N; only selected attributes of records, fields=[...]; with lazy decoding of fields, lazy=True)
 - dump - shorthand for DAST().dump(), uses a global DAST instance created during module initialization
 - load - shorthand for DAST().load(), uses a global DAST instance created during module initialization
 
@@ -101,6 +102,10 @@ Indented format:
     array:
       ...
 
+  array "float64", shape=(1000, 3)        -- binary encoding of numeric arrays, if DAST.arrays is 'base64' or 'zlib':
+    base64 = "AAAAAAAA8D8AAAAAAAAAQA..."  -- raw little-endian buffer in base64 ...
+    zlib = "eAFjYGBgYGRiYGQAAAAMAAE="     -- ... or zlib-compressed, then base64
+
 - custom-class object; arguments to be passed in *args and **kwargs:
 
   module.classname()  OR  module.classname          -- empty instance (inline or endline), no args  
@@ -162,11 +167,14 @@ You should have received a copy of the GNU General Public License along with Nif
 """
 
 
-import re, numpy as np
-from StringIO import StringIO
+import os, re, threading, multiprocessing, traceback, numpy as np
+from types import FunctionType, BuiltinFunctionType
 from itertools import izip
 from datetime import datetime, date, time
-from collections import OrderedDict, defaultdict, namedtuple, Iterator
+from collections import OrderedDict, defaultdict, namedtuple, Iterator, deque
+from Queue import Queue
+from base64 import b64encode, b64decode
+from zlib import compress, decompress
 
 from nifty.util import isstring, isdict, isbound, classname, subdict, Object
 from nifty.text import regex
@@ -208,7 +216,7 @@ class Tokenizer(object):
         # atomic values
         ('FLOAT',  _noalpha % (regex.float + r'|([+-]?[iI]nf)|NaN|nan')),       # any floating-point number, or Inf, or NaN
         ('INT'  ,  _noalpha % regex.int),
-        ('STR'  ,  regex.escaped_string),
+        ('STR'  ,  r'"[^"\\]*(?:\\.[^"\\]*)*"' + r"|'[^'\\]*(?:\\.[^'\\]*)*'"),     # like regex.escaped_string, but unrolled: no backtracking state kept per character, so long strings are fast
         ('NONE' ,  _noalpha % r'None|null|~|-'),
         ('BOOL' ,  _noalpha % r'[tT]rue|[fF]alse'),
         #('INDENT',  r'[ \t]*'),                  # indentation at the beginning of a line; handled in a special way, thus not included in 'tokens', but can be returned from tokenize()
@@ -223,41 +231,96 @@ class Tokenizer(object):
     regex = r'[ \t\v]*(?:%s)' % regex             # every token can have a leading whitespace
     regex = re.compile(regex)
 
+    # First-character dispatch, used by tokenize(). Every character that can start a token is mapped either to a token name
+    # (single-char tokens, emitted without matching), or to a matcher that contains only those alternatives of 'tokens' 
+    # that can start with this character, in their original order, so the result is the same as with 'regex'.
+    # KEY, OBJ and OPEN are merged into one pattern that scans the identifier only once.
+    
+    def _matcher(names, tokens = dict(tokens)):
+        alts = [r'(?P<%s>%s)' % (name, tokens[name]) for name in names]
+        alts.append(r'(?P<OPEN>[\w\.]+)(?:(?=\s*=)(?P<KEY>)|(?=\()(?P<OBJ>))?')
+        return re.compile('|'.join(alts)).match
+    
+    dispatch = dict.fromkeys('\n()[]{}:,=', 'SPEC')
+    dispatch.update(dict.fromkeys('"\'', re.compile(r'(?P<STR>%s)' % dict(tokens)['STR']).match))
+    dispatch['~'] = re.compile(r'(?P<NONE>%s)' % dict(tokens)['NONE']).match
+    dispatch['+'] = re.compile(r'(?P<FLOAT>%s)|(?P<INT>%s)' % (dict(tokens)['FLOAT'], dict(tokens)['INT'])).match
+    dispatch['-'] = re.compile(r'(?P<FLOAT>%s)|(?P<INT>%s)|(?P<NONE>%s)' % (dict(tokens)['FLOAT'], dict(tokens)['INT'], dict(tokens)['NONE'])).match
+    dispatch['.'] = _matcher(['FLOAT'])
+    dispatch.update(dict.fromkeys('0123456789', _matcher(['FLOAT', 'INT'])))
+    dispatch.update(dict.fromkeys('abcdeghjklmopqrsuvwxyzABCDEGHJKLMOPQRSUVWXYZ_', _matcher([])))
+    dispatch.update(dict.fromkeys('iInNtTfF', _matcher(['FLOAT', 'NONE', 'BOOL'])))
+    del _matcher
+    
+    # Whole-line fast path, used by Analyzer.parse(): a "scalar", "key: scalar" or "key = scalar" line, matched with a single regex.
+    # A key followed by '=' can be an identifier (KEY), but only where no atomic token would match, like in 'regex'.
+    _atoms = [(name, pat) for name, pat in tokens if name in ('FLOAT', 'INT', 'STR', 'NONE', 'BOOL')]
+    _atom = '|'.join(pat for name, pat in _atoms)
+    atomline = re.compile(r'([ \t]*)(?:(?P<key>%s)[ \t\v]*[:=]|(?!%s)(?P<ident>[\w\.]+)[ \t\v]*=)?[ \t\v]*(?:%s)[ \t\v]*\n?\Z' 
+                          % (_atom, _atom, '|'.join(r'(?P<%s>%s)' % pair for pair in _atoms))).match
+    atom = re.compile('|'.join(r'(?P<%s>%s)' % pair for pair in _atoms)).match
+    
+    # decoders of atomic values, by token name
+    atoms = {'STR':   lambda val: val[1:-1].decode("string-escape"),
+             'INT':   lambda val: int(val, 0),
+             'FLOAT': float,
+             'NONE':  lambda val: None,
+             'BOOL':  lambda val: val[0] in 'tT',
+             }
     
     @staticmethod
-    def tokenize(text, line = 1, getindent = re.compile(r'[ \t]*').match, gettoken = regex.match):
-        "'text' should be a single line, \n-terminated. 'line' is the current line number, counted from 1."
-        
-        pos = 0                                     # no. of input characters consumed till now
-        match = getindent(text, pos)
-        value = match.group()
-        column = match.start() + 1
+    def tokenize(text, line = 1, getindent = re.compile(r'[ \t]*').match, skipspace = re.compile(r'[ \t\v]*').match, dispatch = dispatch):
+        """'text' should be a single line, \n-terminated. 'line' is the current line number, counted from 1.
+        Dispatches on the 1st character of every token to a small matcher, which gives the same tokens as matching 
+        with the full 'regex' at every position, only faster. Column of a token includes its leading whitespace.
+        >>> for token in Tokenizer.tokenize('  x = __main__.Point(2, -3.5), "s", ~\\n'): print token
+        ('INDENT', '  ', 1, 1)
+        ('KEY', 'x', 1, 3)
+        ('SPEC', '=', 1, 4)
+        ('OBJ', '__main__.Point', 1, 6)
+        ('SPEC', '(', 1, 21)
+        ('INT', '2', 1, 22)
+        ('SPEC', ',', 1, 23)
+        ('FLOAT', '-3.5', 1, 24)
+        ('SPEC', ')', 1, 29)
+        ('SPEC', ',', 1, 30)
+        ('STR', '"s"', 1, 31)
+        ('SPEC', ',', 1, 35)
+        ('NONE', '~', 1, 36)
+        ('SPEC', '\\n', 1, 38)
+        ('EOL', '\\n', 1, 39)
+        >>> [(name, value) for name, value, line, column in Tokenizer.tokenize("list True, nan, None, [7, 'a', -]:\\n")]     # doctest: +NORMALIZE_WHITESPACE
+        [('INDENT', ''), ('OPEN', 'list'), ('BOOL', 'True'), ('SPEC', ','), ('FLOAT', 'nan'), ('SPEC', ','), ('NONE', 'None'), 
+         ('SPEC', ','), ('SPEC', '['), ('INT', '7'), ('SPEC', ','), ('STR', "'a'"), ('SPEC', ','), ('NONE', '-'), ('SPEC', ']'), 
+         ('SPEC', ':'), ('SPEC', '\\n'), ('EOL', '\\n')]
+        """
+        match = getindent(text)
         pos = match.end()
-        yield 'INDENT', value, line, column
-
-        match = gettoken(text, pos)
-        while match is not None:
-            token = match.lastgroup
-            value = match.group(token)
-            column = match.start() + 1
-            pos = match.end()
-            yield token, value, line, column
-
-            #if token == 'NEWLINE':
-            #    linestart = pos
-            #    line += 1
-            #    indent, pos = matchIndent()                 # match and yield indentation at the beginning of the next line
-            #    yield indent
-            
-            match = gettoken(text, pos)
+        yield 'INDENT', match.group(), line, 1
         
-        if pos != len(text):
-            raise DAST_SyntaxError("Unexpected character '%s'", (None, text[pos], line, pos + 1))
+        size = len(text)
+        while True:
+            column = pos + 1                        # the column includes leading whitespace of the token
+            if pos >= size: break
+            char = text[pos]
+            if char in ' \t\v':
+                pos = skipspace(text, pos).end()
+                if pos >= size: break
+                char = text[pos]
+            matcher = dispatch.get(char)
+            if matcher is None: break
+            if matcher == 'SPEC':
+                pos += 1
+                yield 'SPEC', char, line, column
+                continue
+            match = matcher(text, pos)
+            if match is None: break
+            start, pos = pos, match.end()
+            yield match.lastgroup, text[start:pos], line, column
         
-        ## wrapping up in Token slows down the routine substantially!    Token = namedtuple('Token', ['name', 'value', 'line', 'column'])
-        #yield Token('NEWLINE', '\n', line, pos + 1)
-        #yield Token('EOL', '\n', line, pos + 1)     
-        yield ('EOL', '\n', line, pos + 1)          # superflous \n at the end to allow arbitrary consumption (or not) of trailing \n (the true one may be consumed by tokenizer)
+        if pos != size:
+            raise DAST_SyntaxError("Unexpected character '%s'", (None, text[pos], line, pos + 1))
+        yield ('EOL', '\n', line, pos + 1)
 
 
 class Analyzer(object):
@@ -273,11 +336,24 @@ class Analyzer(object):
         
     # TODO: turn off assertions to speed up
         
-    def parse(self, line, tokenize = Tokenizer.tokenize):
+    def parse(self, line, tokenize = Tokenizer.tokenize, atomline = Tokenizer.atomline, atom = Tokenizer.atom, atoms = Tokenizer.atoms):
         """Parses the next line (input string must be a single line, \n-terminated). Returns a tuple: (indent, isopen, ispair, value),
         where 'value' is the final fully decoded object, except for the case when the line is open, 
         then 'value' is an intermediate tuple (typename, args, kwargs) to be extended with data from subsequent lines and then instantiated.
+        Lines of the form "scalar", "key: scalar" or "key = scalar" are parsed in one step, without tokenization.
         """
+        match = atomline(line) if not line.endswith(':\n') else None         # lines of open objects "typename:" are common, skip them quickly
+        if match is not None:
+            kind = match.lastgroup
+            val = atoms[kind](match.group(kind))
+            self.linenum += 1
+            key = match.group('ident')
+            if key is None:
+                key = match.group('key')
+                if key is None: return match.group(1), False, False, val
+                key = atoms[atom(key).lastgroup](key)
+            return match.group(1), False, True, (key, val)
+        
         self.next = next = tokenize(line, self.linenum).next
         self.isopen = False
         
@@ -413,24 +489,42 @@ class Analyzer(object):
 ###  ENCODER
 ###
 
+class _Base64(object):
+    "Base64 code of binary data, wrapped up to be written as a string without escaping (base64 has no special characters)."
+    def __init__(self, code): self.code = code
+
 class Encoder(object):
-    """New encoder is created for every new record to be encoded, to enable use of instance variables 
-    as current state of the encoding, in thread-safe way."""
+    """Instance variables keep current state of the encoding, so an encoder can't be used by multiple threads at the same time.
+    DAST keeps one encoder per thread and reuses it for consecutive records. Output code is collected in a list of fragments 
+    and written out in one call per record."""
 
     # only these parameters will be copied during initialization, for later use    
-    _params = "indent listsep dictsep keysep0 keysep2 none maxindent mode1".split()
+    _params = "indent listsep dictsep keysep0 keysep2 none maxindent mode1 arrays minbinary".split()
+    
+    busy = False            # True when the encoder is in use by DAST.encode(); a reentrant call must create a new encoder
     
     def __init__(self, out, params): #indent, listsep, dictsep, maxindent, mode1):
         #self.indent, self.listsep, self.dictsep, self.maxindent, self.mode1  =  indent, listsep, dictsep, maxindent, mode1
         #if (set(params.keys()) - self._params): raise Exception("One of the parameters is unrecognized: %s" % params.keys())
         params = subdict(params, self._params)
         self.__dict__.update(params)
-        self.out = out                                      # a file-like object where output code will be written to
+        self.out = out                                      # a file-like object where output code will be written to, or None
     
-    def encode(self, obj, mode = 2, level = 0, **kwargs):
-        "level, mode - *initial* level and mode for 'obj' encoding, used for the root node of object hierarchy and modified along the way."
+    def encode(self, obj, mode = 2, level = 0, end = '', **kwargs):
+        """level, mode - *initial* level and mode for 'obj' encoding, used for the root node of object hierarchy and modified along the way.
+        end - a string appended to the output code, like a newline.
+        Returns output code as a string and writes it to self.out, if not None."""
         if kwargs: self.__dict__.update(kwargs)
-        self._encode(obj, mode, level)
+        parts = []
+        self._write = parts.append                          # instance attribute overrides _write() method during encoding
+        try:
+            self._encode(obj, mode, level)
+        finally:
+            del self._write
+        parts.append(end)
+        code = ''.join(parts)
+        if self.out is not None: self.out.write(code)
+        return code
         
     def _encode(self, obj, mode = 0, level = None):
         """Encode object hierarchy rooted at 'obj' and write the output code to self.out.
@@ -449,6 +543,7 @@ class Encoder(object):
         encode(self, obj, mode, level)
         
     def _write(self, s):
+        "Only used outside of encode(), which replaces it with a faster append() to a list of output fragments."
         self.out.write(s)
     def _indent(self, s):
         prefix = self.indent * self.level
@@ -480,6 +575,12 @@ class Encoder(object):
         name = t.__module__ + "." + t.__name__
         self._generic_object(m, l, "type", args0 = (name,))
     
+    def _function(self, f, m, l):
+        "Functions are encoded by name, like types, so only module-level functions can be encoded, not lambdas or nested ones."
+        if f.__name__ == '<lambda>' or f.__module__ is None:
+            raise Exception("dast.Encoder, can't encode function %s, only module-level functions can be encoded" % repr(f))
+        self._type(f, m, l)
+    
     def _list(self, x, mode, level):
         if mode == 0:
             self._write('[')
@@ -567,8 +668,19 @@ class Encoder(object):
         
     def _array(self, x, mode, level):
         dtype = str(x.dtype)
+        if self.arrays != 'text' and x.dtype.kind in 'biufc' and x.size >= self.minbinary:
+            if x.dtype.byteorder == '>': x = x.astype(x.dtype.newbyteorder('<'))
+            data = x.tobytes()
+            if self.arrays == 'zlib': data = compress(data, 1)
+            self._generic_object(mode, level, "array", args0 = (dtype,), kwargs0 = {'shape': x.shape}, kwargs2 = {self.arrays: _Base64(b64encode(data))})
+            return
         data = x.tolist()
         self._generic_object(mode, level, "array", args0 = [dtype], args2 = data)
+    
+    def _base64(self, x, m, l):
+        self._write('"')
+        self._write(x.code)
+        self._write('"')
 
     # for internal use
 
@@ -686,10 +798,10 @@ class Encoder(object):
     # encoders for standard types
     encoders = { int:_int, long:_int, float:_float, bool:_bool, str:_str, unicode:_str, type(None):_none, 
                  datetime:_datetime, date:_date, time:_time,
-                 type:_type, list:_list, tuple:_tuple, set:_set, 
+                 type:_type, FunctionType:_function, BuiltinFunctionType:_function, list:_list, tuple:_tuple, set:_set, 
                  dict:_dict, OrderedDict:_dict, defaultdict:_defaultdict,
                  np.float16:_float, np.float32:_float, np.float64:_float, np.float128:_float,
-                 np.ndarray:_array,
+                 np.ndarray:_array, _Base64:_base64,
                 }
 
 
@@ -717,8 +829,21 @@ class Decoder(object):
         return datetime.strptime(s, '%H:%M:%S').time()
     
     def _defaultdict(*args): return defaultdict(*args)
-    def _array(dtype, *data):
-        return np.array(data, dtype = dtype)
+    def _array(dtype, *data, **binary):
+        """Decoder of numpy arrays, in text form (items in 'data') or binary (DAST.arrays = 'base64' or 'zlib').
+        >>> binary = DAST(arrays = 'base64', minbinary = 0)
+        >>> print binary.encode(np.zeros((0, 5)), mode = 0)
+        array("float64", shape=(0, 5), base64="")
+        >>> binary.decode1(binary.encode(np.zeros((0, 5)))).shape
+        (0, 5)
+        >>> DAST(arrays = 'zlib', minbinary = 0).decode1(DAST(arrays = 'zlib', minbinary = 0).encode(np.array([7], dtype = 'int8')))
+        array([7], dtype=int8)
+        """
+        if not binary: return np.array(data, dtype = dtype)
+        code = binary['base64'] if 'base64' in binary else binary['zlib']
+        data = b64decode(code)
+        if 'zlib' in binary: data = decompress(data)
+        return np.frombuffer(data, dtype = np.dtype(dtype).newbyteorder('<')).reshape(binary['shape']).astype(dtype)
     
     #EOF = object()              # token that indicates end of file OR end of current block during decoding
     dicttype = OrderedDict
@@ -727,12 +852,19 @@ class Decoder(object):
 
     #nocompile = False           # if True, decode() will return syntax trees instead of compiled objects
 
-    def __init__(self, input, decoders = None):
+    def __init__(self, input, decoders = None, fields = None, lazy = False):
         """'decoders': dict of type decoders, {typename: decoder}, to override default Decoder.decoders.
         Decoder can be a function that's fed with all arguments read from the file: decoder(*args, **kwargs).
         OR, decoder can be a class that's instantiated with __new__(*args) - only unnamed arguments passed!
         - and then the object's __dict__ is updated with kwargs.
+        'fields': optional list of dotted paths, like ['url', 'meta.date'], of attributes (or string keys) to be decoded
+        in every top-level record; all other attributes are skipped without parsing. See decodeSelected().
+        'lazy': if True, top-level open records are returned as LazyRecord objects, which decode their fields on first access.
         """
+        self.userdecoders = decoders
+        self.select = _selection(fields) if fields else None
+        self.lazy = lazy
+        
         self.decoders = decs = Decoder.decoders.copy()             # the dict of decoders may get modified during operation, thus shallow-copying
         if decoders: decs.update(decoders)
         
@@ -753,21 +885,34 @@ class Decoder(object):
         
         self.parser = Analyzer(self.decodeType)
         self.line = None                    # the next line to be decoded, in a parsed form; client can read it directly for a preview of the next line; must explicitly call move() afterwards
+        self.raw = None                     # the next line in raw form, before parsing
         self.linenum = 0                    # no. of the current line ('line'), counting from 1
         self.move()
         
-    def move(self):
-        "Load next line to the buffer."
+    def move(self, parse = True):
+        "Load next line to the buffer. If parse=False, only the raw line is loaded and 'line' is None until parse() is called."
         try:
             line = self.input.next()
         except StopIteration, e:
-            self.line = None
+            self.line = self.raw = None
             return
         #print '--', line
         self.linenum += 1
-        self.line = self.parser.parse(line)                 # a tuple: (indent, isopen, ispair, value)
+        self.raw = line
+        self.line = self.parser.parse(line) if parse else None        # a tuple: (indent, isopen, ispair, value)
         #print '++', self.line
 
+    def parse(self):
+        "Parse the buffered line if it was loaded with move(parse=False)."
+        if self.line is None and self.raw is not None:
+            self.parser.linenum = self.linenum
+            self.line = self.parser.parse(self.raw)
+
+    def skipBlock(self, indent):
+        "Skip the buffered raw line and all subsequent lines that are empty or indented more than 'indent', without parsing them."
+        self.move(False)
+        while self.raw is not None and _nested(self.raw, indent): self.move(False)
+
     def hasnext(self, indent):
         "Check if the buffered line (next to be parsed) exists AND is indented MORE than 'indent' (part of a block with header's indentation of 'indent')."
         if self.line is None: return False
@@ -843,13 +988,160 @@ class Decoder(object):
 
         return decoder(*args, **kwargs)                         # decoder is a function, don't bother with __new__ and __dict__
     
+    def decodeSelected(self, indent, select):
+        """Like decodeItem(), but decodes only those attributes (or string keys) of an open object that are present in 'select':
+        a dict of {name: subselect}, where 'subselect' is a similar dict for the nested value, or None to decode the entire value.
+        Lines of other attributes, together with their nested blocks, are skipped by indentation, without parsing.
+        Positional arguments are always decoded. Closed objects, coded in a single line, are decoded as a whole and then projected.
+        """
+        hasnext = self.skipempty(indent)
+        if not hasnext: return None
+        indent, isopen, ispair, obj = self.line
+        if ispair: key, obj = obj
+        
+        if not isopen:
+            self.move()
+            obj = _project(obj, select)
+        else:
+            typename, args, kwargs = obj
+            self.move(False)
+            while self.raw is not None:
+                raw = self.raw
+                body = raw.lstrip(' \t')
+                if not body.strip():                                # empty line
+                    self.move(False)
+                    continue
+                subindent = raw[:len(raw) - len(body)]
+                if not (len(subindent) > len(indent) and subindent.startswith(indent)): break      # end of block?
+                name = _fieldname(body)
+                if name is not None and name not in select:
+                    self.skipBlock(subindent)
+                    continue
+                self.parse()
+                subselect = select.get(name) if name is not None else None
+                argObj, argIspair = self.decodeSelected(indent, subselect) if subselect else self.decodeItem(indent)
+                if argIspair:
+                    k, v = argObj
+                    kwargs[k] = v
+                else:
+                    args.append(argObj)
+            self.parse()
+            
+            for k in kwargs.keys():                                 # drop inline arguments from the header line and non-string keys of dicts
+                if k not in select: del kwargs[k]
+                elif select[k]: kwargs[k] = _project(kwargs[k], select[k])
+            obj = self.decodeType(typename, args, kwargs)
+        
+        if ispair: return (key, obj), True
+        return obj, False
+    
+    def decodeLazy(self, select = None):
+        """Decode a top-level record, but if it's an open object, return a LazyRecord that keeps raw lines of all keyword attributes
+        (or string keys), only to decode them on first access. If 'select' is given, other attributes are skipped, like in decodeSelected()."""
+        hasnext = self.skipempty(None)
+        if not hasnext: return None
+        indent, isopen, ispair, obj = self.line
+        if not isopen or ispair:                                    # nothing to be deferred
+            return self.decodeSelected(None, select) if select else self.decodeItem(None)
+        
+        typename, args, kwargs = obj
+        raw = {}
+        self.move(False)
+        while self.raw is not None:
+            line = self.raw
+            body = line.lstrip(' \t')
+            if not body.strip():
+                self.move(False)
+                continue
+            subindent = line[:len(line) - len(body)]
+            if not (len(subindent) > len(indent) and subindent.startswith(indent)): break
+            name = _fieldname(body)
+            if name is None:                                        # positional argument, or a dict item with a non-string key: decode now
+                self.parse()
+                argObj, argIspair = self.decodeItem(indent)
+                if argIspair:
+                    k, v = argObj
+                    kwargs[k] = v
+                else:
+                    args.append(argObj)
+            elif select and name not in select:
+                self.skipBlock(subindent)
+            else:
+                lines = raw[name] = [line]
+                self.move(False)
+                while self.raw is not None and _nested(self.raw, subindent):
+                    lines.append(self.raw)
+                    self.move(False)
+        self.parse()
+        
+        if select:
+            for k in kwargs.keys():
+                if k not in select: del kwargs[k]
+                elif select[k]: kwargs[k] = _project(kwargs[k], select[k])
+        return LazyRecord(typename, args, kwargs, raw, self.userdecoders, select), False
+    
     def decode(self):
+        select = self.select
         while True:
-            item = self.decodeItem(None)
+            if self.lazy: item = self.decodeLazy(select)
+            elif select: item = self.decodeSelected(None, select)
+            else: item = self.decodeItem(None)
             if item is None: break
             yield item[0]
         
 
+class LazyRecord(object):
+    """A top-level record decoded with DAST.load(..., lazy = True). Its attributes (or string keys, for dicts) that were written 
+    on separate lines are kept in raw form and decoded on first access, either as record.name or record['name'].
+    Positional arguments and arguments from the header line are decoded upfront. Call decode() to decode all the remaining fields
+    and create the actual object of the record's type.
+    
+    >>> rec = decode1('dict:\\n  "url": "http://x.org"\\n  "meta": dict:\\n    "date": date "2015-06-01"\\n', lazy = True)
+    >>> rec
+    LazyRecord(dict, decoded=[], pending=['meta', 'url'])
+    >>> rec['url'], rec.meta
+    ('http://x.org', {'date': datetime.date(2015, 6, 1)})
+    >>> rec.decode() == {'url': 'http://x.org', 'meta': {'date': date(2015, 6, 1)}}
+    True
+    """
+    def __init__(self, typename, args, kwargs, raw, decoders = None, select = None):
+        self._type = typename
+        self._args = args
+        self._kwargs = kwargs           # decoded fields
+        self._raw = raw                 # pending fields, as lists of raw lines: {name: lines}
+        self._decoders = decoders
+        self._select = select
+    
+    def __getattr__(self, name):
+        if name.startswith('_'): raise AttributeError(name)         # internal attributes, or not yet initialized during unpickling
+        try: return self[name]
+        except KeyError: raise AttributeError("LazyRecord of type '%s' has no field '%s'" % (self._type, name))
+    
+    def __getitem__(self, name):
+        kwargs = self._kwargs
+        if name in kwargs: return kwargs[name]
+        lines = self._raw.pop(name)
+        subselect = self._select.get(name) if self._select else None
+        decoder = Decoder(lines, self._decoders)
+        (key, value), _ = decoder.decodeSelected(None, subselect) if subselect else decoder.decodeItem(None)
+        kwargs[key] = value
+        return value
+
+    def __contains__(self, name):
+        return name in self._kwargs or name in self._raw
+    
+    def keys(self):
+        return list(self._kwargs) + list(self._raw)
+    
+    def decode(self):
+        "Decode all the pending fields and return the actual object."
+        for name in self._raw.keys(): self[name]
+        return Decoder([], self._decoders).decodeType(self._type, list(self._args), self._kwargs.copy())
+    
+    def __repr__(self):
+        return "LazyRecord(%s, decoded=%s, pending=%s)" % (self._type, sorted(self._kwargs), sorted(self._raw))
+        
+
 def _import(path):
     """Load the module and return the class/function/var, given its full package/module path.
     If no module name is present, __main__ is used.
@@ -873,6 +1165,78 @@ def _import(path):
 
 #_import('nifty.util.Object')
 
+_fieldpattern = re.compile(r"""(?:([\w\.]+)[ \t\v]*=|"([^"\\\n]*)"[ \t\v]*:|'([^'\\\n]*)'[ \t\v]*:)""").match
+
+def _fieldname(line):
+    """Name of the attribute or string key in a raw, indentation-stripped line of the form "key = ..." or '"key": ...', 
+    or None if the line is not a pair, or has a non-string key. Used for skipping of unselected fields without parsing."""
+    match = _fieldpattern(line)
+    if match is None: return None
+    return match.group(match.lastindex)
+
+def _nested(line, indent):
+    "True if a raw 'line' is empty or indented more than 'indent'."
+    body = line.lstrip(' \t')
+    if not body.strip(): return True
+    n = len(line) - len(body)
+    return n > len(indent) and line.startswith(indent)
+
+def _selection(fields):
+    """Convert a list of dotted paths, like ['url', 'meta.date'], into a tree of dicts: {'url': None, 'meta': {'date': None}},
+    where None means that the entire value is selected.
+    >>> _selection(['a.b', 'c', 'a.d.e', 'c.f'])
+    {'a': {'b': None, 'd': {'e': None}}, 'c': None}
+    """
+    select = {}
+    for path in fields:
+        node = select
+        names = path.split('.')
+        for name in names[:-1]:
+            if name in node and node[name] is None: break           # the entire value already selected
+            node = node.setdefault(name, {})
+        else:
+            node[names[-1]] = None
+    return select
+
+def _project(obj, select):
+    """Remove from a decoded object all attributes (or dict keys) not present in 'select', recursively. 
+    Objects that are neither dicts nor instances with __dict__ are returned unchanged."""
+    if not select: return obj
+    if isdict(obj): d = obj
+    elif hasattr(obj, '__dict__') and not isinstance(obj, (type, FunctionType)): d = obj.__dict__
+    else: return obj
+    for k in d.keys():
+        if k not in select: del d[k]
+        elif select[k]: d[k] = _project(d[k], select[k])
+    return obj
+
+def _recordRanges(filename, start, chunksize):
+    """Generator of (start, end) byte ranges of 'filename' of approx. 'chunksize' bytes each, beginning at 'start', 
+    whose boundaries are placed at top-level records: non-empty lines with zero indentation. Used by DAST.load() with workers."""
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        while start < size:
+            f.seek(max(start + chunksize, start + 1) - 1)
+            f.readline()                                    # skip the rest of a line that might have been cut in the middle
+            while True:
+                end = f.tell()
+                line = f.readline()
+                if not line or line[0] not in ' \t\r\n': break
+            end = min(end, size)
+            yield start, end
+            start = end
+
+def _decodeRange(dast, filename, start, end, fields = None, lazy = False):
+    """Runs in a worker process of DAST.load(). Decodes all records from the byte range [start,end) of a file.
+    Returns a pair: (list of objects, formatted traceback or None)."""
+    try:
+        with open(filename, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        return list(dast.decode(data, fields, lazy)), None
+    except Exception:
+        return None, "in a chunk at bytes %s-%s:\n%s" % (start, end, traceback.format_exc())
+
 
 ########################################################################################################################################################
 ###
@@ -900,6 +1264,8 @@ class DAST(object):
     none    = "~"           # what string to use for Nones; only '~', '-', 'null' or 'None' allowed
     maxindent = 3           # no. of nesting levels before the encoder turns from mode-2 to mode-1 or 0 
     mode1 = True            # use mode-1 when possible (True) or mode-0 instead (False)
+    arrays = 'text'         # encoding of numeric numpy arrays: 'text' (list of numbers), 'base64' (raw buffer), 'zlib' (compressed raw buffer)
+    minbinary = 100         # arrays with fewer elements are always encoded as text
 
     # initial mode and level, for encoding root node of object hierarchy
     mode = 2
@@ -910,43 +1276,121 @@ class DAST(object):
 
     def __init__(self, **kwargs):
         self.__dict__.update(kwargs)                    # one-time assignment of all properties
+    
+    def __setattr__(self, name, value):
+        "Parameters changed: drop cached parameters and encoders."
+        self.__dict__[name] = value
+        self.__dict__.pop('_cache', None)
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_cache', None)
+        return state
+    
+    def _encoder(self):
+        """Return (encoder, params) for the current thread, created on the first call and reused afterwards. 
+        A new encoder is created if the cached one is in use already (reentrant call from inside encoding)."""
+        cache = self.__dict__.get('_cache')
+        if cache is None: cache = self.__dict__['_cache'] = threading.local()
+        encoder = getattr(cache, 'encoder', None)
+        if encoder is None or encoder.busy:
+            params = getattr(cache, 'params', None)
+            if params is None:
+                params = cache.params = DAST.__dict__.copy()
+                params.update(self.__dict__)
+            encoder = Encoder(None, params)
+            if getattr(cache, 'encoder', None) is None: cache.encoder = encoder
+        return encoder, cache.params
 
     def dump(self, obj, out = None, newline = True, **kwargs):
         """Encode object hierarchy rooted at 'obj' and write to 'out' file-like object, or return as a string if out=None. 
         Add newline(s) at the end of produced code if newline=True (default) or 1+."""
         return self.encode(obj, out, newline = newline, **kwargs)
     
-    def load(self, input):
+    def load(self, input, workers = None, ordered = True, chunksize = 4 << 20, fields = None, lazy = False):
         """Generator. Yields consecutive objects decoded from 'input'. 
         'input' is either a file object, or a name of file to be opened.
-        If you have a string with encoded data, not a file, use decode() instead."""
+        If you have a string with encoded data, not a file, use decode() instead.
+        
+        If 'workers' is given, the file is decoded in parallel by a pool of 'workers' processes (0 for the no. of CPUs).
+        The file is split into byte ranges of approx. 'chunksize' bytes, cut at top-level record boundaries 
+        (non-empty lines with zero indentation), and every range is decoded by a worker as a separate DAST stream.
+        Records are yielded in their original order (ordered=True), or in the order of chunk completion (ordered=False, faster).
+        A file object must be seekable and have a 'name'; decoding starts at its current position.
+        Decoded objects must be picklable, as they're sent back from workers.
+        
+        'fields' and 'lazy' allow partial decoding of records, see decode().
+        """
+        if workers is not None: return self._loadParallel(input, workers, ordered, chunksize, fields, lazy)
         if isstring(input): input = open(input, 'rt')
-        return self.decode(input)
+        return self.decode(input, fields, lazy)
     
+    def _loadParallel(self, input, workers, ordered, chunksize, fields, lazy):
+        if isstring(input): filename, start = input, 0
+        else: filename, start = input.name, input.tell()
+        
+        workers = workers or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(workers)
+        maxtasks = 2 * workers                                  # max. no. of chunks being decoded or waiting for pickup; bounds memory usage
+        ranges = _recordRanges(filename, start, chunksize)
+        done = Queue() if not ordered else None                 # in unordered mode, results are pushed here by pool callbacks
+        pending = deque()                                       # in ordered mode, AsyncResults of submitted chunks
+        submitted = collected = 0
+        aborted = True
+        try:
+            while True:
+                # submit new byte ranges until the buffer is full or the file is exhausted
+                while ranges is not None and submitted - collected < maxtasks:
+                    task = next(ranges, None)
+                    if task is None:
+                        ranges = None
+                        break
+                    args = (self, filename) + task + (fields, lazy)
+                    if ordered: pending.append(pool.apply_async(_decodeRange, args))
+                    else: pool.apply_async(_decodeRange, args, callback = done.put)
+                    submitted += 1
+                if submitted == collected: break
+                
+                items, error = pending.popleft().get() if ordered else done.get()
+                collected += 1
+                if error: raise Exception("DAST.load(), exception in a worker process while decoding '%s':\n%s" % (filename, error))
+                for item in items: yield item
+            aborted = False
+        finally:
+            if aborted: pool.terminate()
+            else: pool.close()
+            pool.join()
+
     def encode(self, obj, out = None, newline = False, **kwargs):
         "Like dump(), only newline=False by default. Used internally by dump()."
-        if out is None:
-            out = StringIO()
-            string = True
+        if kwargs:
+            params = DAST.__dict__.copy()
+            params.update(self.__dict__)
+            params.update(kwargs)
+            encoder = Encoder(None, params)
         else:
-            string = False
-            
-        params = DAST.__dict__.copy()
-        params.update(self.__dict__)
-        params.update(kwargs)
-        encoder = Encoder(out, params)
-        encoder.encode(obj, params['mode'], params['level'])
-        if newline: out.write('\n' * int(newline))
-        if string: return out.getvalue()
-
-    def decode(self, input):
-        return Decoder(input, self.decoders).decode()
+            encoder, params = self._encoder()
+        
+        encoder.busy = True
+        try:
+            code = encoder.encode(obj, params['mode'], params['level'], end = '\n' * int(newline) if newline else '')
+        finally:
+            encoder.busy = False
+        if out is None: return code
+        out.write(code)
+
+    def decode(self, input, fields = None, lazy = False):
+        """Generator. Yields consecutive objects decoded from 'input' string or an iterable of lines.
+        'fields': list of dotted paths, like ['url', 'meta.date'], of attributes (or string keys) to be decoded in every top-level record;
+                  other attributes are dropped, and if coded in separate lines, skipped by indentation without parsing.
+        'lazy': if True, records that span multiple lines are yielded as LazyRecord objects, which decode their fields on first access."""
+        return Decoder(input, self.decoders, fields, lazy).decode()
         #return Decoder(input, self.parser, self.decoders).decode()
 
-    def decode1(self, input):
+    def decode1(self, input, **kwargs):
         "Decode only the 1st object, ignore the rest. Exception if no object present."
         try:
-            return self.decode(input).next()
+            return self.decode(input, **kwargs).next()
         except StopIteration, e:
             raise Exception("No object decoded")
 
@@ -956,11 +1400,11 @@ class DAST(object):
 dast = DAST()
 
 def dump(obj, **kwargs):  return dast.dump(obj, **kwargs)
-def load(input):          return dast.load(input)
+def load(input, **kwargs):  return dast.load(input, **kwargs)
 
 def encode(obj, **kwargs):  return dast.encode(obj, **kwargs)
-def decode(input):          return dast.decode(input)
-def decode1(input):         return dast.decode1(input)
+def decode(input, **kwargs):   return dast.decode(input, **kwargs)
+def decode1(input, **kwargs):  return dast.decode1(input, **kwargs)
 
 #####################################################################################################################################################
 
@@ -15,17 +15,23 @@ You should have received a copy of the GNU General Public License along with Nif
 '''
 
 from __future__ import absolute_import
-import sys, heapq, math, numpy as np, jsonpickle, csv, itertools, threading
+import os, sys, heapq, math, random, socket, select, numpy as np, jsonpickle, csv, itertools, threading, multiprocessing, traceback, tempfile, shutil, atexit, cPickle as pickle
 from copy import copy, deepcopy
-from time import time, sleep
+from time import time, clock, sleep
 from Queue import Queue
-from itertools import islice
-from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from multiprocessing.connection import Listener, AuthenticationError, answer_challenge, deliver_challenge
+from itertools import islice, izip, imap
+from operator import itemgetter
+from contextlib import contextmanager
+from functools import partial
+from collections import OrderedDict, deque
 
 from nifty.util import isint, islist, isstring, issubclass, isfunction, iscontainer, istype, \
                        classname, getattrs, setattrs, divup, Tee, openfile
-from nifty.util import Object, __Object__, NoneLock
-from nifty.files import GenericFile, File as files_File, SafeRewriteFile, ObjectFile, JsonFile, DastFile
+from nifty.util import Object, __Object__, NoneLock, freeze
+from nifty.files import GenericFile, File as files_File, SafeRewriteFile, GroupFile, SafeRewriteGroupFile, \
+                        ObjectFile, JsonFile, DastFile, PickleFile
 
 
 #####################################################################################################################################################
@@ -152,6 +158,7 @@ class __Cell__(__Object__):
         super(__Cell__, cls).__init__(*args)
         cls.label('__knobs__')
         cls.label('__inner__')
+        cls.label('__shared__')
         #print cls, 'knobs:', cls.__knobs__
 
 
@@ -200,11 +207,19 @@ class Cell(Object):
     which provides __getstate__ and __setstate__ methods.
     You can serialize a cell by calling, for instance: dast.dump(cell, afile).
     
+    COPYING.
+    
+    Heavy read-only attributes (models, dictionaries, datasets...) can be labelled as shared, by listing their names 
+    in the __shared__ label of the class. They're passed by reference to copies made with copy(), deepcopy() and copy1(),
+    instead of being copied, so that templates can be cheaply cloned, e.g., by Grid or by '>>' on pipelines.
+    The cell and all its copies must treat shared attributes as immutable.
+    
     """
     __metaclass__ = __Cell__
 
     __knobs__  = []         # names of attributes that serve as knobs of a given class; list, string, or class __knobs__: ...
     __inner__ = []
+    __shared__ = []         # names of read-only attributes that are shared by reference, not copied, in copy(), deepcopy() and copy1()
 
     name = None             # optional label, not necessarily unique, that identifies this cell instance or a group of cells in signal routing
     owner = None            # the cell which owns 'self' and creates an environment where 'self' lives; typically 'self' is present in owner.__inner__
@@ -249,7 +264,8 @@ class Cell(Object):
     def copy(self, deep = True):
         """Shorhand for copy(self) or deepcopy(self).
         In Pipes, 'source' is excluded from copying and the returned pipe has source UNassigned, 
-        even when deep copy (configured in __transient__ and handled by Object.__getstate__)."""
+        even when deep copy (configured in __transient__ and handled by Object.__getstate__).
+        In deep copy, attributes listed in __shared__ are passed by reference."""
         if deep: 
             #if self.source: raise Exception("Deep copy called for a data pipe of %s class with source already assigned." % classname(self))
             return deepcopy(self) 
@@ -260,8 +276,21 @@ class Cell(Object):
         (lists/dicts) of pipes/knobs can be modified afterwards without affecting original ones."""
         res = copy(self)
         d = res.__dict__
+        shared = self.__shared__
         for k, v in d.iteritems():
-            d[k] = copy(v)
+            if k not in shared: d[k] = copy(v)
+        return res
+    
+    def __deepcopy__(self, memo):
+        """Like the default deepcopy, which honors __transient__ through __getstate__/__setstate__, 
+        but attributes listed in __shared__ are passed to the copy by reference."""
+        res = self.__class__.__new__(self.__class__)
+        memo[id(self)] = res
+        state = self.__getstate__()
+        shared = self.__shared__
+        if shared: state = {k: v if k in shared else deepcopy(v, memo) for k, v in state.iteritems()}
+        else: state = deepcopy(state, memo)
+        res.__setstate__(state)
         return res
         
     def getKnobs(self):
@@ -321,15 +350,18 @@ class OpenPipes(list):
     executions form a stack, but this not always must be the case, e.g. with multi-input pipes 
     - that's why pop() takes a pipe object again.
     """
+    lock = threading.Lock()         # pipes running in parallel threads (Grid) push and pop concurrently
+    
     def push(self, pipe):
-        self.append(pipe)
+        with self.lock: self.append(pipe)
     def pop(self, pipe):
-        i = len(self)
-        while i:
-            i -= 1
-            if self[i] is pipe:
-                list.pop(self, i)
-                return
+        with self.lock:
+            i = len(self)
+            while i:
+                i -= 1
+                if self[i] is pipe:
+                    list.pop(self, i)
+                    return
         raise Exception("OpenPipes.pop, trying to pop an object that's not present on the list: %s" % pipe)
      
     def __str__(self):
@@ -436,6 +468,36 @@ class Pipe(Cell):
         better override iter() not __iter__()."""
         raise NotImplemented()
 
+    def buffered(self):
+        """No. of items currently held in internal buffers of the pipe, or None if the pipe doesn't buffer data.
+        Override in pipes that keep queues of items; sampled during profiling to report peak buffer sizes (see Profile)."""
+        return None
+
+    def tell(self):
+        """In source pipes: position in the data source right after the last item yielded, which can be passed later on to seek(),
+        to resume iteration from this point without re-reading preceding data. None if not supported. See Pipeline.run(checkpoint)."""
+        return None
+    
+    def seek(self, pos):
+        "In source pipes that implement tell(): make the next iteration start at position 'pos' returned earlier by tell()."
+        raise Exception("%s doesn't support seek()" % self)
+
+    def getState(self):
+        """Picklable part of the state of the pipe, as a dict, to be saved in a checkpoint by Pipeline.run(checkpoint=...).
+        Taken from __getstate__(), so it includes knobs, counters and accumulators of statistics (sums, sizes, ...),
+        but attributes that can't be pickled (functions, files) and runtime flags are left out."""
+        try: state = self.__getstate__()
+        except Exception: state = self.__dict__.copy()
+        for name in ('iterating', 'created', 'out', 'mustclose'): state.pop(name, None)
+        for name, value in state.items():
+            try: pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            except Exception: del state[name]
+        return state
+    
+    def setState(self, state):
+        "Restore a state saved by getState(). Called during iteration, after open() and before the 1st item is processed."
+        self.__dict__.update(state)
+
     def _prolog(self):
         if not self.created:            # call reset/setup() if needed
             self.reset()
@@ -480,15 +542,23 @@ class Pipe(Cell):
         return Union(self, other)
 
     def __batch_iter__(self, maxsize = 100):
-        "Like __iter__, but yields batches of data items instead of single items. Every batch is a list."
-        batch = []
-        for item in self.__iter__():
-            if len(batch) >= maxsize: 
-                self.yielded += len(batch)
+        """Like __iter__, but yields batches of data items instead of single items. Every batch is a list or a NumPy array
+        of up to 'maxsize' items (batch-native pipes may yield shorter batches, but never empty ones).
+        This base implementation only groups items yielded by __iter__, which also maintains the 'yielded' counter.
+        Batch-native pipes (Transform, Filter, Monitor, Pipeline) override this method to pass entire batches 
+        between consecutive pipes, without a generator hop for every individual item.
+        Note that this base implementation pulls items from the source one by one, through __iter__, so a pipe that is not 
+        batch-native (e.g., Limit, or sinks like Count and List) turns the whole chain of pipes upstream of it 
+        back into per-item iteration."""
+        it = self.__iter__()
+        try:
+            while True:
+                batch = list(islice(it, maxsize))
+                if not batch: return
                 yield batch
-                batch = []
-            batch.append(item)
-        if batch: yield batch
+        finally:
+            close = getattr(it, 'close', None)
+            if close: close()
 
     def stats(self):
         """String with detailed statistics of the no. of input & output items that passed through the pipe in the current
@@ -537,6 +607,31 @@ class _Functional(Pipe):
     class __knobs__:
         fun = None              # plain python function (or lambda) that implements class functionality, if core method not overriden
     
+    def __batch_iter__(self, maxsize = 100):
+        """Pulls batches of items from the source and passes each of them to process_batch(), which returns a batch of output items.
+        During process_batch(), self.count holds the no. of input items read before the current batch, 
+        unless the default per-item implementation of process_batch() updates it item by item."""
+        header = self._prolog()
+        if header is not None: yield [header]
+        try:
+            self.count = 0
+            for batch in _batches(self.source, maxsize):
+                count = self.count + len(batch)
+                out = self.process_batch(batch)
+                self.count = count
+                if len(out):
+                    self.yielded += len(out)
+                    yield out
+        except GeneratorExit, ex:
+            self._epilog()
+            raise
+        self._epilog()
+
+    def process_batch(self, batch):
+        """Processes a batch (list or NumPy array) of input items and returns a list or array of output items. 
+        Override in subclasses to provide vectorized processing; Transform, Monitor and Filter provide defaults that call their per-item methods."""
+        raise NotImplementedError("%s.process_batch() not implemented" % classname(self))
+
 #     def __init__(self, *args, **knobs):
 #         "Inner function - if present - must be given as 1st and only unnamed argument. All knobs given as keyword args."
 #         if args: self.fun = args[0]
@@ -571,6 +666,19 @@ class Transform(_Functional):
     def process(self, item):
         "Return modified item; or None, interpreted as no result (drop item). Subclasses can read self.count to get 1-based index of the current item."
         return self.fun(item)
+
+    def process_batch(self, batch):
+        """Fallback to per-item process(), with the same interpretation of its results as in __iter__. If process() is not overridden,
+        self.fun is mapped over the batch directly, like in Fused._steps(), and self.count is only updated by __batch_iter__, per batch."""
+        if type(self).process.im_func is Transform.process.im_func:
+            return [item if res is None else res for item, res in izip(batch, map(self.fun, batch)) if res is not False]
+        out = []
+        process = self.process
+        for item in batch:
+            self.count += 1
+            res = process(item)
+            if res is not False: out.append(item if res is None else res)
+        return out
     
 class Monitor(_Functional):
     """A pipe that (by assumption) doesn't modify input items, only observes the data and possibly produces 
@@ -651,6 +759,18 @@ class Monitor(_Functional):
     def monitor(self, item):
         "Override in subclasses to process next item during iteration. If printing a log, use self.out as the output stream."
         self.process(item)              # for backward compatibility, process() is still called; TODO: remove process() and leave only monitor() in the future
+    def process_batch(self, batch):
+        """Calls monitor() on every item of the batch. Returns the batch unmodified. If neither monitor() nor process() is overridden,
+        self.fun is mapped over the batch directly, like in Fused._steps(), and self.count is only updated by __batch_iter__, per batch."""
+        cls = type(self)
+        if cls.monitor.im_func is Monitor.monitor.im_func and cls.process.im_func is Monitor.process.im_func:
+            map(self.fun, batch)
+            return batch
+        monitor = self.monitor
+        for item in batch:
+            self.count += 1
+            monitor(item)
+        return batch
     def process(self, item):
         "Can return modified item; or None, interpreted as no result (drop item); or True (pass unchanged); or False (drop item)."
         #if self.fun is None: raise Exception("Missing inner function (self.fun) in class %s" % classname(self))
@@ -682,6 +802,18 @@ class Filter(_Functional):
 
     def accept(self, item):
         return self.process(item)
+    def process_batch(self, batch):
+        """Fallback to per-item accept(). Subclasses can return a boolean-masked array instead: batch[mask]. If neither accept() nor process() 
+        is overridden, self.fun is applied to the batch directly, like in Fused._steps(), and self.count is only updated by __batch_iter__, per batch."""
+        cls = type(self)
+        if cls.accept.im_func is Filter.accept.im_func and cls.process.im_func is Filter.process.im_func:
+            return [item for item in batch if self.fun(item)]
+        out = []
+        accept = self.accept
+        for item in batch:
+            self.count += 1
+            if accept(item): out.append(item)
+        return out
     def process(self, item):                            # deprecated in Filter; override accept() instead
         return self.fun(item)
 
@@ -711,12 +843,24 @@ class Collection(Pipe):
     In subclasses, set 'self.data' with the iterable to take data from; optionally override open() to initialize 'data' just before iteration starts,
     but note that close() is not called (this would require control over iteration process and yielding items one-by-one, 
     instead of following back on the collection's own iterator).
+    The data are shared, not copied, between copies of the pipe (see Cell.__shared__).
     """
+    __shared__ = "data"
+    
     def __init__(self, data):
         self.data = data
     def __iter__(self):             # Pipe fields: count, yielded, ... are not used, they will have default (empty) values
         self.open()
         return iter(self.data)
+    def __batch_iter__(self, maxsize = 100):
+        "Lists, tuples and arrays are sliced directly into batches, other collections are grouped item by item."
+        self.open()
+        data = self.data
+        if not isinstance(data, (list, tuple, np.ndarray)): 
+            for batch in _batches(data, maxsize): yield batch
+            return
+        for start in xrange(0, len(data), maxsize):
+            yield data[start:start+maxsize]
 
 class File(Pipe):
     """Wrapper for a file object opened for reading. Iteration delegates to file.__iter__(). 
@@ -836,15 +980,88 @@ class Limit(Pipe):
             yield item
             if self.count >= self.limit: return
 
-class DropWhile(Pipe):
-    "Like itertools.dropwhile()."
-class TakeWhile(Pipe):
-    "Like itertools.takewhile()."    
-class StopOn(Pipe):
+class _Chained(Pipe):
+    """Base class for pipes implemented as a chain of itertools iterators over the source, so that the loop over items runs in C.
+    Subclasses implement chain(source). Input items are counted by a C-level counter zipped with the source, 
+    and 'count' and 'yielded' are updated only at the end of iteration (or when it's closed), not per item."""
+    
+    def chain(self, source):
+        "Override in subclasses. Return an iterator over output items, given an iterator over input items."
+        raise NotImplementedError("%s.chain() not implemented" % classname(self))
+    
+    def __iter__(self):
+        header = self._prolog()
+        if header is not None: yield header
+        counter = itertools.count()
+        source = imap(itemgetter(0), izip(self.source, counter))   # source first: izip doesn't advance the counter when the source ends
+        yielded = 0
+        try:
+            for yielded, item in enumerate(self.chain(source), 1): yield item
+        except GeneratorExit, ex:
+            self.count, self.yielded = counter.next(), yielded
+            self._epilog()
+            raise
+        self.count, self.yielded = counter.next(), yielded
+        self._epilog()
+
+class DropWhile(_Chained):
+    """Like itertools.dropwhile(): drop initial items as long as fun(item) is true, then pass all remaining items.
+    >>> Range(6) >> DropWhile(lambda x: x < 3) >> List >> Print >> RUN
+    [3, 4, 5]
+    """
+    class __knobs__:
+        fun = None
+    def chain(self, source):
+        return itertools.dropwhile(self.fun, source)
+
+class TakeWhile(_Chained):
+    """Like itertools.takewhile(): pass items as long as fun(item) is true, terminate the stream at the 1st item that fails.
+    >>> Range(6) >> TakeWhile(lambda x: x < 3) >> List >> Print >> RUN
+    [0, 1, 2]
+    """
+    class __knobs__:
+        fun = None
+    def chain(self, source):
+        return itertools.takewhile(self.fun, source)
+
+class StopOn(_Chained):
     """Terminate the data stream when a given condition becomes True. Condition is a function that takes current item as an argument. 
-    This function can also keep an internal state (memory)."""
-class Loop(Pipe):
-    """Iterate over the source a number of times, concatenating the repeated input streams into one output stream."""
+    This function can also keep an internal state (memory). The item that satisfied the condition is not yielded.
+    >>> Range(6) >> StopOn(lambda x: x == 4) >> List >> Print >> RUN
+    [0, 1, 2, 3]
+    """
+    class __knobs__:
+        fun = None
+    def chain(self, source):
+        fun = self.fun
+        return itertools.takewhile(lambda item: not fun(item), source)
+
+class Loop(_Chained):
+    """Iterate over the source a number of times ('times'; infinitely if None), concatenating the repeated input streams 
+    into one output stream. The source is re-iterated in every repetition, unless cycle=True: then, items of the 1st pass
+    are kept in memory and replayed (like itertools.cycle), which works also for sources that can be iterated only once.
+    >>> Range(3) >> Loop(2) >> List >> Print >> RUN
+    [0, 1, 2, 0, 1, 2]
+    >>> PIPE >> iter([1, 2]) >> Loop(3, cycle = True) >> List >> Print >> RUN
+    [1, 2, 1, 2, 1, 2]
+    """
+    class __knobs__:
+        times = None
+        cycle = False
+    
+    def __iter__(self):
+        if self.cycle: return super(Loop, self).__iter__()
+        return Pipe.__iter__(self)
+    
+    def chain(self, source):
+        "Used when cycle=True: the source is read once."
+        if self.times is None: return itertools.cycle(source)
+        data = list(source)
+        return itertools.chain.from_iterable(itertools.repeat(data, self.times))
+    
+    def iter(self):
+        "Used when cycle=False: the source is re-iterated in every repetition."
+        return itertools.chain.from_iterable(itertools.repeat(self.source) if self.times is None else itertools.repeat(self.source, self.times))
 
 class Subset(Pipe):
     """Selects every 'fraction'-th item from the stream, equally spaced, yielding <= 1/fraction of all data. Deterministic subset, no randomization.
@@ -867,43 +1084,459 @@ class Subset(Pipe):
                 batch = 0
 
 class Sample(Pipe):
-    "Random sample of input items. Every input item is decided independently with a given probability, unconditional on what items were chosen earlier."
+    """Random sample of input items, in one of two modes:
+    - Bernoulli (if 'k' is None): every input item is decided independently with probability 'p', unconditional on what items 
+      were chosen earlier. Gaps between chosen items are drawn from geometric distribution and skipped over, 
+      so only 1 random number is drawn per output item, not per input item.
+    - reservoir (if 'k' is given): uniform sample of exactly 'k' items (or all, if there are fewer), from a stream of unknown length, 
+      kept in O(k) memory with Li's Algorithm L (also with geometric skips). Items are yielded after the stream ends, in input order.
+    If 'seed' is not None, the same sample is drawn in every iteration and every run, which makes experiments reproducible.
+    >>> Range(20) >> Sample(0.3, seed = 1) >> List >> Print >> RUN
+    [0, 6, 11, 12, 14, 16, 19]
+    >>> Range(1000) >> Sample(k = 5, seed = 1) >> List >> Print >> RUN
+    [348, 443, 673, 901, 998]
+    """
+    class __knobs__:
+        p    = None             # probability of choosing an item, in Bernoulli mode
+        k    = None             # size of the sample, in reservoir mode
+        seed = None             # seed for the random generator; None for a random seed
+
+    def iter(self):
+        rand = random.Random(self.seed)
+        if self.k is not None: return self._reservoir(rand)
+        if self.p is None: raise Exception("Sample, either 'p' or 'k' knob must be set")
+        return self._bernoulli(rand)
+    
+    def _bernoulli(self, rand):
+        p = self.p
+        if p >= 1: return iter(self.source)
+        if p <= 0: return iter([])
+        return self._skipping(rand, math.log(1 - p))
+    
+    def _skipping(self, rand, logq):
+        source = iter(self.source)
+        while True:
+            skip = int(math.log(1 - rand.random()) / logq)              # no. of items skipped before the next chosen one: Geometric(p) - 1
+            for item in islice(source, skip, skip + 1): break
+            else: return
+            yield item
     
+    def _reservoir(self, rand):
+        k = self.k
+        source = iter(self.source)
+        reservoir = list(enumerate(islice(source, k)))                  # pairs (index, item), index to restore the input order at the end
+        if len(reservoir) == k and k > 0:
+            w = math.exp(math.log(rand.random() or 1e-300) / k)
+            pos = k - 1                                                 # index of the last item read
+            while True:
+                skip = int(math.log(1 - rand.random()) / math.log(1 - w)) if w < 1 else 0
+                for item in islice(source, skip, skip + 1): break
+                else: break
+                pos += skip + 1
+                reservoir[rand.randrange(k)] = (pos, item)
+                w *= math.exp(math.log(rand.random() or 1e-300) / k)
+        reservoir.sort(key = lambda entry: entry[0])
+        for _, item in reservoir: yield item
+
 
 ###  Buffers
 
-#class Cache(Pipe):
-class Buffer(Pipe):
-    """Upon setup(), buffers all input data in memory. Then, when data is buffered, 
-    can iterate (multiple times) over it and yield from memory."""
+class Prefetch(Pipe):
+    """Pulls items from the source in a background thread and keeps up to 'size' of them in a bounded queue,
+    so that slow (I/O-bound) reading of the source overlaps with processing done by downstream pipes.
+    Exceptions raised in the source are re-raised in the consumer. When iteration is closed before the end,
+    the background thread is stopped and joined.
+    >>> Range(5) >> Prefetch(2) >> List >> Print >> RUN
+    [0, 1, 2, 3, 4]
+    """
+    class __knobs__:
+        size = 100                  # max. no. of items prefetched and waiting in the queue
+    
+    thread = None                   # background Thread, present during iteration
+    
+    def iter(self):
+        self.thread = thread = Thread(Pipeline(self.source), outsize = self.size)
+        thread.daemon = True
+        thread.start()
+        self.count = 0
+        try:
+            for item in thread:
+                self.count += 1
+                yield item
+        finally:
+            thread.stop()
+            del self.thread
+    
+    def buffered(self):
+        return self.thread.output.qsize() if self.thread else None
+
+class Cache(Pipe):
+    """On the first iteration, passes input items through and saves them in a store: a list in memory (storage='memory'),
+    or a file of pickled items (storage='disk'), located in 'path' or in a temporary file if path=None.
+    Subsequent iterations replay items from the store without touching the source, which is useful when 
+    the source is expensive to compute or read and the data are iterated over many times.
+    Disk storage yields fresh copies of items in every replay, so modifications made by downstream pipes 
+    don't leak between iterations; memory storage yields the same objects every time.
+    If the first iteration is interrupted before the end, the partial store is discarded (a file given in 'path' is left on disk, incomplete). 
+    Call clear() to drop the store.
+    >>> cache = Cache('disk')
+    >>> cache.source = Range(3) >> Print
+    >>> list(cache)
+    0
+    1
+    2
+    [0, 1, 2]
+    >>> list(cache)
+    [0, 1, 2]
+    >>> cache.clear()
+    """
+    __transient__ = "store cached"      # the store is not copied together with the pipe
+    
+    class __knobs__:
+        storage = 'memory'              # 'memory' or 'disk'
+        path    = None                  # in disk mode: file name of the store; temporary file if None
+    
+    store  = None                       # list of cached items, or the name of the file with pickled items
+    cached = False                      # is the store complete and ready for replay?
+    
+    def iter(self):
+        if self.cached: return self._replay()
+        if self.storage not in ('memory', 'disk'): raise Exception("Cache, unknown storage: %s" % self.storage)
+        return self._fill()
+    
+    def _fill(self):
+        self.clear()
+        self.count = 0
+        if self.storage == 'memory':
+            store = []
+            for item in self.source:
+                self.count += 1
+                store.append(item)
+                yield item
+            self.store = store
+            self.cached = True
+            return
+        
+        path = self.path
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix = 'cache-', suffix = '.pickle')
+            os.close(fd)
+        f = PickleFile(path, 'wb')
+        complete = False
+        try:
+            for item in self.source:
+                self.count += 1
+                f.write(item)
+                yield item
+            complete = True
+        finally:
+            f.close()
+            if complete: self.store = path
+            elif self.path is None: os.remove(path)             # only a temporary file is removed, a file given by the caller is left untouched
+        self.cached = True
+    
+    def _replay(self):
+        self.count = 0
+        store = self.store if self.storage == 'memory' else PickleFile(self.store, 'rb')
+        for item in store:
+            self.count += 1
+            yield item
+    
+    def clear(self):
+        "Drop the store. A temporary file is removed, while a file given in 'path' is left on disk."
+        if self.storage == 'disk' and self.store and self.path is None and os.path.exists(self.store): os.remove(self.store)
+        self.store = None
+        self.cached = False
+    
+    def reset(self):
+        self.clear()
+
+class Buffer(Cache):
+    """Upon first iteration, buffers all input data in memory. Then, when data is buffered, 
+    can iterate (multiple times) over it and yield from memory. Same as Cache with storage='memory'."""
+    class __knobs__:
+        storage = 'memory'
 
 class Sort(Pipe):
     """Total or partial in-memory heap sort of the input stream. Buffers items in a heap and when the heap is full, 
     outputs them in sorted order. Heap size can be unlimited (default), which results in total sorting: 
     output items appear only after all input data was consumed; or limited to a predefined maximum size 
     (partial sort, generation of output items begins as soon as the heap achieves its maximum size).
+    Total sort can work in external-memory mode, for data that don't fit in memory: if 'memory' is set, 
+    input is read in chunks of 'memory' items, each chunk is sorted and spilled to a temporary file 
+    (pickled, in 'tmpdir' folder), and at the end, all the sorted runs are merged lazily with heapq.merge.
+    'key' and 'reverse' have the same meaning as in sorted(). Sorting is stable in all modes.
     >>> Collection([2,7,3,6,8,3]) >> Sort(2) >> List >> Print >> RUN
     [2, 3, 6, 7, 3, 8]
+    >>> Collection([2,7,3,6,8,3]) >> Sort(key = lambda x: -x, memory = 4) >> List >> Print >> RUN
+    [8, 7, 6, 3, 3, 2]
     """
     class __knobs__:
-        size = None
+        size    = None          # max. heap size in partial sort; None for total sort
+        key     = None          # function that calculates a comparison key for every item, like in sorted()
+        reverse = False         # if True, items are sorted in descending order
+        memory  = None          # max. no. of items kept in memory during total sort; if exceeded, sorted runs are spilled to disk
+        tmpdir  = None          # folder for temporary files with sorted runs; system default if None
 
     def iter(self):
+        if self.size: return self._partial()
+        if self.memory: return self._external()
+        return iter(sorted(self.source, key = self.key, reverse = self.reverse))
+
+    def _decorate(self, items, run = 0):
+        "Generates triples (sortkey, (run, index), item) to be compared in heaps instead of the items themselves."
+        key = self.key
+        reverse = self.reverse
+        for i, item in enumerate(items):
+            k = key(item) if key else item
+            yield (_Reversed(k) if reverse else k), (run, i), item
+    
+    def _partial(self):
         from heapq import heapify, heappush, heappop
-        source = iter(self.source)
+        source = self._decorate(self.source)
         
         # prolog: fill out the heap with initial data and heapify in one step
-        heap = list(islice(source, self.size)) if self.size else list(source)
+        heap = list(islice(source, self.size))
         heapify(heap)
         
         # more input data remains?
-        if self.size and len(heap) == self.size:
-            for item in source:
-                yield heappop(heap)
-                heappush(heap, item)
+        if len(heap) == self.size:
+            for entry in source:
+                yield heappop(heap)[2]
+                heappush(heap, entry)
         
         # epilog: flush remaining items
-        while heap: yield heappop(heap)
+        while heap: yield heappop(heap)[2]
+
+    def _external(self):
+        source = iter(self.source)
+        runs = []                                               # temporary files with sorted runs
+        try:
+            while True:
+                chunk = sorted(islice(source, self.memory), key = self.key, reverse = self.reverse)
+                if not runs and len(chunk) < self.memory:      # all data fit in memory? no need to spill
+                    for item in chunk: yield item
+                    return
+                if not chunk: break
+                f = tempfile.TemporaryFile(dir = self.tmpdir)
+                pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+                for item in chunk: 
+                    pickler.dump(item)
+                    pickler.clear_memo()
+                runs.append(f)
+                del chunk
+            
+            readers = [self._decorate(_readPickles(f), run) for run, f in enumerate(runs)]
+            for entry in heapq.merge(*readers): yield entry[2]
+        finally:
+            for f in runs: f.close()
+
+
+class _Reversed(object):
+    "Wrapper that reverses the ordering of values, for sorting in descending order with heaps."
+    __slots__ = ['value']
+    def __init__(self, value): self.value = value
+    def __lt__(self, other): return other.value < self.value
+    def __eq__(self, other): return self.value == other.value
+
+def _readPickles(f):
+    "Generates consecutive objects from a file containing a sequence of pickles. Starts reading from the beginning of the file."
+    f.seek(0)
+    unpickler = pickle.Unpickler(f)
+    while True:
+        try: yield unpickler.load()
+        except EOFError: return
+
+
+###  Aggregation
+
+class Accumulator(object):
+    """Incremental aggregate of values in a group of items, for use in GroupBy. Subclasses implement add(), merge() and result(). 
+    Accumulators must be picklable, because they can be spilled to disk (see GroupBy.memory)."""
+    def add(self, value):
+        "Include a new value in the aggregate."
+    def merge(self, other):
+        "Include all values aggregated by another accumulator of the same class."
+    def result(self):
+        "Final value of the aggregate."
+
+class AccCount(Accumulator):
+    def __init__(self): self.n = 0
+    def add(self, value): self.n += 1
+    def merge(self, other): self.n += other.n
+    def result(self): return self.n
+
+class AccSum(Accumulator):
+    def __init__(self): self.sum = 0
+    def add(self, value): self.sum += value
+    def merge(self, other): self.sum += other.sum
+    def result(self): return self.sum
+
+class AccMean(Accumulator):
+    "Sample mean; with Welford's numerically stable update, which allows calculation of the standard deviation, too (see AccStd)."
+    def __init__(self): self.n, self.mean, self.m2 = 0, 0.0, 0.0
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+    def merge(self, other):
+        if not other.n: return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+    def result(self): return self.mean if self.n else None
+
+class AccStd(AccMean):
+    "Sample standard deviation, like Mean.deviation()."
+    def result(self): return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else None
+
+class AccMin(Accumulator):
+    def __init__(self): self.value = None
+    def add(self, value): 
+        if self.value is None or value < self.value: self.value = value
+    def merge(self, other): 
+        if other.value is not None: self.add(other.value)
+    def result(self): return self.value
+
+class AccMax(AccMin):
+    def add(self, value): 
+        if self.value is None or value > self.value: self.value = value
+
+class AccTop(Accumulator):
+    "Top-k largest values, returned as a list in descending order."
+    def __init__(self, k = 10): 
+        self.k = k
+        self.heap = []
+    def add(self, value):
+        if len(self.heap) < self.k: heapq.heappush(self.heap, value)
+        elif value > self.heap[0]: heapq.heapreplace(self.heap, value)
+    def merge(self, other):
+        for value in other.heap: self.add(value)
+    def result(self): return sorted(self.heap, reverse = True)
+
+
+class GroupBy(Pipe):
+    """Keyed aggregation. Splits input items into groups by the value of key(item) and aggregates values of items 
+    in every group with a given accumulator (Accumulator subclass). Yields (key, result) pairs, one for each group.
+    'aggregate' is a name of a standard accumulator: count, sum, mean, std, min, max, top (top-10);
+    or an Accumulator subclass; or an Accumulator instance that will be copied for every group, e.g., AccTop(3);
+    or a list of the above - then the result is a tuple of results of all accumulators.
+    Values to be aggregated are calculated by value(item), or are the items themselves if value=None.
+    
+    Two modes of operation:
+    - presorted=True: input items are already sorted (grouped) by key; groups are aggregated and yielded one by one, 
+      only 1 group is kept in memory;
+    - presorted=False (default): groups are kept in a hash table and yielded at the end, in arbitrary order. 
+      If 'memory' is not None and the no. of groups exceeds 'memory', accumulators are spilled to temporary files,
+      partitioned by hash of key into 'partitions' files, and at the end every partition is loaded and merged separately.
+    
+    >>> words = "ala ma kota a kot ma ale".split()
+    >>> PIPE >> words >> GroupBy(lambda w: w[0], ['count', 'max']) >> Sort >> List >> Print >> RUN
+    [('a', (3, 'ale')), ('k', (2, 'kota')), ('m', (2, 'ma'))]
+    >>> Range(10) >> GroupBy(lambda x: x // 4, 'mean', presorted = True) >> List >> Print >> RUN
+    [(0, 1.5), (1, 5.5), (2, 8.5)]
+    """
+    
+    accumulators = {'count': AccCount, 'sum': AccSum, 'mean': AccMean, 'std': AccStd, 'min': AccMin, 'max': AccMax, 'top': AccTop}
+    
+    class __knobs__:
+        key        = None           # function that calculates the key of grouping for a given item
+        aggregate  = 'count'        # accumulator(s) to be used for every group
+        value      = None           # function that calculates the value to be aggregated for a given item; None for the item itself
+        presorted  = False          # are input items sorted by key already?
+        memory     = None           # max. no. of groups kept in memory in hash mode; None for no limit
+        partitions = 16             # no. of partitions (temporary files) for spilling groups to disk
+        tmpdir     = None           # folder for temporary files; system default if None
+    
+    def _factories(self):
+        "List of functions that create new accumulators for a group, and a flag whether the aggregate was given as a list."
+        def factory(acc):
+            if isstring(acc): return self.accumulators[acc]
+            if istype(acc): return acc
+            return lambda: deepcopy(acc)
+        if islist(self.aggregate): return [factory(a) for a in self.aggregate], True
+        return [factory(self.aggregate)], False
+    
+    def iter(self):
+        factories, multi = self._factories()
+        key, value = self.key, self.value
+        def result(accs):
+            if multi: return tuple(acc.result() for acc in accs)
+            return accs[0].result()
+        
+        self.count = 0
+        if self.presorted:
+            current = accs = None
+            for item in self.source:
+                self.count += 1
+                k = key(item)
+                if accs is None or k != current:
+                    if accs is not None: yield current, result(accs)
+                    current, accs = k, [f() for f in factories]
+                v = value(item) if value else item
+                for acc in accs: acc.add(v)
+            if accs is not None: yield current, result(accs)
+            return
+        
+        groups = {}
+        spill = _Partitions(self.partitions, self.tmpdir) if self.memory else None
+        try:
+            for item in self.source:
+                self.count += 1
+                k = key(item)
+                accs = groups.get(k)
+                if accs is None:
+                    if spill and len(groups) >= self.memory:
+                        spill.write(groups.iteritems())
+                        groups = {}
+                    groups[k] = accs = [f() for f in factories]
+                v = value(item) if value else item
+                for acc in accs: acc.add(v)
+            
+            if not (spill and spill.used):
+                for k, accs in groups.iteritems(): yield k, result(accs)
+                return
+            
+            spill.write(groups.iteritems())
+            del groups
+            for part in spill.read():
+                groups = {}
+                for k, accs in part:
+                    current = groups.get(k)
+                    if current is None: groups[k] = accs
+                    else:
+                        for acc, other in zip(current, accs): acc.merge(other)
+                for k, accs in groups.iteritems(): yield k, result(accs)
+                del groups
+        finally:
+            if spill: spill.close()
+
+
+class _Partitions(object):
+    "A set of temporary files that hold (key, value) pairs partitioned by hash of the key, for spilling data to disk."
+    def __init__(self, n, tmpdir = None):
+        self.n = n
+        self.tmpdir = tmpdir
+        self.files = None
+        self.used = False
+    
+    def write(self, pairs):
+        if self.files is None:
+            self.files = [tempfile.TemporaryFile(dir = self.tmpdir) for _ in xrange(self.n)]
+        self.used = True
+        files, n = self.files, self.n
+        for pair in pairs: pickle.dump(pair, files[hash(pair[0]) % n], pickle.HIGHEST_PROTOCOL)
+    
+    def read(self):
+        "Generates, for every partition, a generator of its (key, value) pairs."
+        for f in self.files or []: yield _readPickles(f)
+    
+    def close(self):
+        for f in self.files or []: f.close()
+        self.files = None
 
 
 #####################################################################################################################################################
@@ -1082,6 +1715,27 @@ class Metric(Monitor):
         """Override in subclasses to update internal structures for calculation of an aggregated metric, 
         after new individual sample was measured with the result 'metric'."""
         
+    def process_batch(self, batch):
+        "Batch-mode monitoring: metrics of all items of the batch are calculated in metric_batch() and aggregated at once in aggregate_batch()."
+        metrics = self.metric_batch(batch)
+        if len(metrics):
+            self.last = metrics[-1]
+            self.aggregate_batch(metrics)
+        return batch
+    
+    def metric_batch(self, batch):
+        """Override in subclasses to calculate metrics of all items of a batch at once, typically with NumPy. 
+        Returns a list or array of not-None metrics. Default: metric() called for every item, Nones dropped."""
+        metric = self.metric
+        return [m for m in (metric(item) for item in batch) if m is not None]
+    
+    def aggregate_batch(self, metrics):
+        """Override in subclasses to aggregate a list or array of metrics at once. Must update self.size. 
+        Default: aggregate() called for every metric."""
+        for metric in metrics:
+            self.aggregate(metric)
+            self.size += 1
+        
     def report(self):
         """Override in subclasses to print out calculated metrics at the end of data iteration. 
            Don't use self.printlock! This would cause a deadlock."""
@@ -1090,34 +1744,194 @@ class Metric(Monitor):
 class Mean(Metric):
     """Calculates sample mean & std.deviation of values measured for individual items by a given metric.
     The metric is either implemented in overridden metric() method, or given as a function - argument of initialization
-    (typically a lambda expression).
+    (typically a lambda expression). Metrics can be scalars or vectors (lists, NumPy arrays) - then mean and deviation
+    are calculated for each component separately.
+    Aggregation uses Welford's update for individual metrics and Chan's formula for merging batches (in batch mode, 
+    see Metric.metric_batch), which are numerically stable, unlike accumulation of a sum of squares.
+    >>> Collection([[1, 10], [2, 20], [3, 60]]) >> Mean(fun = lambda x: x) >> RUN
+    mean +stddev /size:    [2.0000 30.0000] +[1.00 26.46] /3
     """
     class __knobs__:
         title = None                # leading message when printing the report line
         
     def open(self):
-        self.sum = self.sum2 = 0.0
+        self.avg = 0.0              # running mean
+        self.m2 = 0.0               # running sum of squared deviations from the mean
     
     def aggregate(self, metric):
-        self.sum += metric
-        self.sum2 += metric ** 2
+        if isinstance(metric, (list, tuple)): metric = np.asarray(metric, dtype = float)
+        delta = metric - self.avg
+        self.avg = self.avg + delta / float(self.size + 1)
+        self.m2 = self.m2 + delta * (metric - self.avg)
+
+    def aggregate_batch(self, metrics):
+        values = np.asarray(metrics, dtype = float)
+        n, m = self.size, len(values)
+        avg = values.mean(axis = 0)
+        delta = avg - self.avg
+        self.avg = self.avg + delta * (m / float(n + m))
+        self.m2 = self.m2 + ((values - avg) ** 2).sum(axis = 0) + delta ** 2 * (n * m / float(n + m))
+        self.size = n + m
 
     def mean(self): 
         "Sample mean"
-        return self.sum / float(self.size)
+        return self.avg
 
     def deviation(self): 
         "Sample standard deviation"
-        N = float(self.size)
-        return np.sqrt((self.sum2 - self.sum/N * self.sum) / (N-1))
+        return np.sqrt(self.m2 / (self.size - 1.))
 
     def report(self):
         header = "mean +stddev /size:    "
         if self.title: header = self.title + ' ' + header
         if self.size:
-            print >>self.out, header + "%.4f +%.2f /%d" % (self.mean(), self.deviation(), self.size)
+            print >>self.out, header + "%s +%s /%d" % (_format(self.mean(), "%.4f"), _format(self.deviation(), "%.2f"), self.size)
         else:
             print >>self.out, header + "None +None /%s" % self.size
+
+def _format(value, fmt):
+    "Format a scalar, or every component of a vector, with 'fmt'."
+    if np.ndim(value) == 0: return fmt % value
+    return '[' + ' '.join(fmt % v for v in np.ravel(value)) + ']'
+
+
+class _Sampled(Metric):
+    """Base class for monitors that aggregate scalar metrics in NumPy arrays. Metrics of individual items are collected 
+    in a buffer and passed to merge() in chunks of 'buffer' values; in batch mode, whole batches are passed to merge()."""
+    
+    class __knobs__:
+        title  = None               # leading message when printing the report
+        buffer = 10000              # no. of individual metrics collected before merging them into aggregated structures
+    
+    def _prolog(self):
+        self.values = []            # metrics not yet merged
+        return super(_Sampled, self)._prolog()
+    
+    def aggregate(self, metric):
+        self.values.append(metric)
+        if len(self.values) >= self.buffer: self.flush()
+    
+    def aggregate_batch(self, metrics):
+        self.flush()
+        values = np.asarray(metrics, dtype = float).ravel()
+        self.merge(values)
+        self.size += len(values)
+    
+    def flush(self):
+        "Merge buffered metrics. Called automatically before results are calculated."
+        if not self.values: return
+        values, self.values = np.asarray(self.values, dtype = float), []
+        self.merge(values)
+    
+    def merge(self, values):
+        "Override in subclasses to aggregate a 1D array of new metrics."
+        
+    
+class Quantiles(_Sampled):
+    """Streaming estimation of quantiles of a scalar metric, with a merging t-digest: values are summarized by 
+    a sorted list of weighted centroids, which are small near the tails (more accurate extreme quantiles) 
+    and larger in the middle. Memory is O(compression), regardless of the no. of items. 
+    New values are merged with centroids in chunks, with NumPy vectorized operations.
+    >>> Range(1001) >> Quantiles(fun = lambda x: x, probs = [0.01, 0.5, 0.99]) >> RUN
+    quantiles (0.01 0.5 0.99) /size:    9.5100 500.0000 990.4900 /1001
+    """
+    class __knobs__:
+        probs       = (0.5, 0.9, 0.99)      # probabilities of quantiles to be reported
+        compression = 200                   # max. no. of centroids is about compression/2; larger means more accurate
+    
+    def open(self):
+        self.means = np.zeros(0)            # means of centroids, sorted
+        self.weights = np.zeros(0)          # no. of values summarized by each centroid
+        self.min = self.max = None
+    
+    def merge(self, values):
+        if not len(values): return
+        lo, hi = values.min(), values.max()
+        self.min = lo if self.min is None else min(self.min, lo)
+        self.max = hi if self.max is None else max(self.max, hi)
+        means = np.concatenate([self.means, values])
+        weights = np.concatenate([self.weights, np.ones(len(values))])
+        order = np.argsort(means, kind = 'mergesort')
+        means, weights = means[order], weights[order]
+        
+        # group consecutive centroids so that every group spans at most 1 unit of the k1 scale function: k(q) = delta/2pi * asin(2q-1)
+        cum = np.cumsum(weights)
+        q = (cum - weights / 2.) / cum[-1]
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        groups = np.floor(k - k[0]).astype(int)
+        self.weights = np.bincount(groups, weights)
+        self.means = np.bincount(groups, weights * means)
+        nonempty = self.weights > 0
+        self.weights = self.weights[nonempty]
+        self.means = self.means[nonempty] / self.weights
+    
+    def quantile(self, p):
+        "Estimated quantile(s) for probability p (a scalar or a sequence), by interpolation between centroids. None if no data."
+        self.flush()
+        if self.min is None: return None
+        total = self.weights.sum()
+        centers = np.concatenate([[0], np.cumsum(self.weights) - self.weights / 2., [total]])
+        means = np.concatenate([[self.min], self.means, [self.max]])
+        return np.interp(np.asarray(p) * total, centers, means)
+    
+    def report(self):
+        header = "quantiles (%s) /size:    " % ' '.join(map(str, self.probs))
+        if self.title: header = self.title + ' ' + header
+        if self.size:
+            print >>self.out, header + "%s /%d" % (_format(self.quantile(self.probs), "%.4f")[1:-1], self.size)
+        else:
+            print >>self.out, header + "None /%s" % self.size
+
+
+class Histogram(_Sampled):
+    """Histogram of a scalar metric, with fixed bins, counted with NumPy. Bins are given as a list of edges, 
+    or as a no. of equal bins spanning 'range'; if range=None, it's taken from min and max of the first 'buffer' metrics.
+    Values outside of the bins are counted as underflow/overflow. The last bin includes its upper edge.
+    >>> Range(10) >> Histogram(fun = lambda x: x, bins = 2, range = (0, 8)) >> RUN
+    histogram /size:    10
+      < 0.0000: 0
+      0.0000 - 4.0000: 4
+      4.0000 - 8.0000: 5
+      > 8.0000: 1
+    """
+    class __knobs__:
+        bins  = 10                  # no. of bins, or a sequence of bin edges
+        range = None                # (min, max) of bins if 'bins' is a number
+    
+    def open(self):
+        self.edges = None if isint(self.bins) else np.asarray(self.bins, dtype = float)
+        if self.edges is None and self.range: self.edges = np.linspace(self.range[0], self.range[1], self.bins + 1)
+        self.counts = np.zeros(len(self.edges) - 1, dtype = int) if self.edges is not None else None
+        self.under = self.over = 0
+    
+    def merge(self, values):
+        if not len(values): return
+        if self.edges is None:
+            self.edges = np.linspace(values.min(), values.max(), self.bins + 1)
+            self.counts = np.zeros(self.bins, dtype = int)
+        edges, nbins = self.edges, len(self.counts)
+        pos = np.searchsorted(edges, values, side = 'right') - 1
+        pos[values == edges[-1]] = nbins - 1
+        under, over = (pos < 0), (pos >= nbins)
+        self.under += int(under.sum())
+        self.over += int(over.sum())
+        self.counts += np.bincount(pos[~(under | over)], minlength = nbins)
+    
+    def histogram(self):
+        "Pair of arrays (counts, edges), like in np.histogram(); underflow/overflow counts are available in self.under and self.over."
+        self.flush()
+        return self.counts, self.edges
+    
+    def report(self):
+        counts, edges = self.histogram()
+        header = "histogram /size:    %s" % self.size
+        if self.title: header = self.title + ' ' + header
+        print >>self.out, header
+        if counts is None: return
+        print >>self.out, "  < %.4f: %d" % (edges[0], self.under)
+        for i, count in enumerate(counts):
+            print >>self.out, "  %.4f - %.4f: %d" % (edges[i], edges[i+1], count)
+        print >>self.out, "  > %.4f: %d" % (edges[-1], self.over)
     
 
 # class Experiment(Monitor):
@@ -1163,12 +1977,18 @@ class Pile(Pipe):
     
     fileclass = None            # subclass of ObjectFile to be used as an underlying object-oriented file implementation
     file      = None
+    reader    = None            # in read mode, the file being read during iteration
+    start     = None            # in read mode, position in the file where the next iteration will start, set by seek()
     
-    def __init__(self, f, fileclass = None, append = False, flush = 0, rewrite = False, emptylines = 0):
+    def __init__(self, f, fileclass = None, append = False, flush = 0, rewrite = False, emptylines = 0, batch = 0, synctime = None, syncbytes = None):
         """
         f: either a file object (ObjectFile in *closed* state), or a file name (string).
         rewrite: if True, SafeRewriteFile class will be used in write operations, for safe rewrite of an existing file.
         emptylines: no. of extra empty lines after every object.
+        batch: if >0, encoded items are collected in memory and written to disk in batches of this many bytes, 
+               by a background thread (group commit, see files.GroupFile), so that the pipeline never waits for the disk.
+        synctime, syncbytes: with batch>0, the background thread calls fsync() every 'synctime' seconds or 'syncbytes' bytes
+               (None: no fsync, the data are made durable by the OS at its own pace).
         """
         if fileclass: self.fileclass = fileclass
         self.file = f
@@ -1176,6 +1996,9 @@ class Pile(Pipe):
         self.flush = flush
         self.rewrite = rewrite
         self.emptylines = emptylines
+        self.batch = batch
+        self.synctime = synctime
+        self.syncbytes = syncbytes
         
     def __iter__(self):
         if self.source: return self._write()
@@ -1184,7 +2007,11 @@ class Pile(Pipe):
     def _write(self):
         if isstring(self.file):
             mode = 'at' if self.append else 'wt'
-            rawclass = SafeRewriteFile if self.rewrite else files_File
+            if self.batch:
+                groupclass = SafeRewriteGroupFile if self.rewrite else GroupFile
+                rawclass = partial(groupclass, batch = self.batch, synctime = self.synctime, syncbytes = self.syncbytes)
+            else:
+                rawclass = SafeRewriteFile if self.rewrite else files_File
             f = self.fileclass(self.file, mode = mode, cls = rawclass, flush = self.flush, emptylines = self.emptylines)
         else:
             f = self.file
@@ -1203,8 +2030,21 @@ class Pile(Pipe):
         else:
             f = self.file
             f.open()
-        for item in f: yield item
+        if self.start is not None:
+            f.seek(self.start)
+            self.start = None
+        self.reader = f
+        try:
+            for item in f: yield item
+        finally:
+            del self.reader
         f.close()
+    
+    def tell(self):
+        return self.reader.tell() if self.reader else None
+    
+    def seek(self, pos):
+        self.start = pos
         
 class JsonPile(Pile):
     fileclass = JsonFile
@@ -1283,17 +2123,37 @@ class Wrapper(MetaPipe):
 class Pipeline(MetaPipe):
     """Sequence of data pipes connected sequentially, one after another. Pipeline is a MetaPipe and a Pipe itself.
     Inner pipes can be accessed by indexing operator: pipeline[3]
+    If 'batch' is set, inner pipes pass data in batches of up to 'batch' items (see Pipe.__batch_iter__),
+    which greatly reduces per-item overhead of cheap pipes, while the pipeline still yields individual items.
+    Only batch-native pipes (see Pipe.__batch_iter__) pass batches on: all pipes upstream of the last non-batch-native one 
+    (e.g., a Limit, or a Count or List sink) are iterated item by item, as if 'batch' was not set.
+    
+    >>> pipeline = Range(10) >> Transform(lambda x: x+1) >> Filter(lambda x: x % 2)
+    >>> list(pipeline.__batch_iter__(4))
+    [[1, 3], [5, 7], [9]]
+    >>> pipeline = Range(10) >> Transform(lambda x: x+1) >> Filter(lambda x: x % 2) >> List >> Print
+    >>> pipeline.batch = 4
+    >>> pipeline.run()
+    [1, 3, 5, 7, 9]
     """
     
     pipes    = None         # static list of pipes as passed during pipeline initialization; may contain non-pipe objects
     pipeline = None         # the actual pipes used in iteration, created dynamically in __iter__ or setKnobs() 
     knobs    = None         # knobs to be set before iteration starts; 
                             # for delayed setting of knobs, necessary when some pipes are only templates that require normalization
+    batch    = None         # if not None, inner pipes exchange data in batches of this size, via __batch_iter__
+    fuse     = True         # shall adjacent plain Transforms/Filters be fused into a single stage (Fused) during iteration?
+    chain    = None         # pipes actually connected and iterated over: self.pipeline with adjacent functional pipes fused
+    profile  = False        # if True, per-stage performance statistics are collected during iteration, in self.profiler (see Profile)
+    profiler = None         # Profile of the last iteration, if 'profile' was set
+    progress = None         # _Checkpoint that tracks progress of the source during run(checkpoint=...)
     
     #__inner__ = "pipeline"
     
     def __init__(self, *pipes, **knobs):
         self.pipes = list(pipes)
+        if 'batch' in knobs: self.batch = knobs['batch']
+        if 'profile' in knobs: self.profile = knobs['profile']
         
     def __rshift__(self, other):
         """Append 'other' to the end of the pipeline. Shallow-copy the pipeline beforehand, 
@@ -1342,26 +2202,89 @@ class Pipeline(MetaPipe):
     def setup(self):
         #self.pipes = _normalize(self.pipes)
         self.pipeline = _normalize(self.pipes)
+        self.chain = Fused.fuseAll(self.pipeline) if self.fuse else self.pipeline
         self.setInnerKnobs(self.knobs)
         self.knobs = None
 #         for pipe in self.pipeline:
 #             pipe.setup()
 
-    def iter(self):
-        # normalize pipes; connect into a list; connect entire pipeline with the source
-        #self.pipeline = _normalize(self.pipes)
-        prev = self.source
-        for next in self.pipeline:
+    def connect(self):
+        """Connect inner pipes into a chain and connect the entire pipeline with the source. Return (head, tail) pipes.
+        In profiling mode, pipes are not fused, and every pipe is wrapped up in a probe that measures its performance;
+        the head returned is then the last probe, not a pipe."""
+        chain = self.chain
+        if self.profile:
+            chain = self.pipeline
+            self.profiler = profiler = Profile(self)
+            for pipe in chain:
+                if isinstance(pipe, Pipeline) and not pipe.profile: profiler.nest(pipe)     # nested pipelines are profiled, too, to report all flattened pipes
+        
+        prev = upstream = self.source
+        for next in chain:
             if prev is not None: next.source = prev         # 1st pipe can be a generator or collection, not necessarily a Pipe (no .source attribute)
             prev = next
-            
-        # pull data
-        head, tail = self.pipeline[-1], self.pipeline[0]
-        for item in head: 
-            self.count = tail.count                         # update indirectly how many items were read from source
-            yield item
-        self.count = tail.count        
+            if self.profile: prev = upstream = profiler.probe(next, upstream)
+            if self.progress and next is chain[0]: prev = self.progress.track(prev)
+        head, tail = prev, chain[0]
+        if not hasattr(tail, 'count'): tail = Pipe          # a raw iterable as the 1st pipe? no count of input items available, use the class default (None)
+        return head, tail
+
+    def iter(self):
+        head, tail = self.connect()
+        try:
+            if self.batch:
+                for batch in head.__batch_iter__(self.batch):
+                    self.count = tail.count
+                    for item in batch: yield item
+            else:
+                for item in head: 
+                    self.count = tail.count                 # update indirectly how many items were read from source
+                    yield item
+            self.count = tail.count
+        finally:
+            if self.profile: self.profiler.stop()
+    
+    def __batch_iter__(self, maxsize = None):
+        "Batch-mode iteration over the pipeline. 'maxsize' defaults to self.batch, or 100 if the latter is unset."
+        maxsize = maxsize or self.batch or 100
+        header = self._prolog()
+        if header is not None: yield [header]
+        try:
+            head, tail = self.connect()
+            try:
+                for batch in head.__batch_iter__(maxsize):
+                    self.count = tail.count
+                    self.yielded += len(batch)
+                    yield batch
+                self.count = tail.count
+            finally:
+                if self.profile: self.profiler.stop()
+        except GeneratorExit, ex:
+            self._epilog()
+            raise
+        self._epilog()
     
+    def run(self, checkpoint = None, every = 1000):
+        """Pull all data through the pipeline, like Pipe.run(). If 'checkpoint' is given, it's a name of file where 
+        progress of processing is saved every 'every' input items: position in the source (see Pipe.tell), 
+        or the no. of items read if the source doesn't support tell(); and states of all other pipes (see Pipe.getState).
+        If the checkpoint file exists when run() starts, processing resumes from the saved point: the source is moved 
+        with seek() (or already processed items are skipped), and states of pipes are restored. The file is removed 
+        when the pipeline completes. Checkpoints are taken when an item leaves the pipeline, so the last pipe must yield items;
+        and resumption is exact only if no pipe holds items in internal buffers (Sort, Batch, Prefetch, ...) at that time."""
+        if checkpoint is None: return super(Pipeline, self).run()
+        self.progress = progress = _Checkpoint(self, checkpoint)
+        try:
+            progress.resume()
+            last = progress.count
+            for item in self:
+                if progress.count - last >= every:
+                    progress.save()
+                    last = progress.count
+        finally:
+            del self.progress
+        progress.remove()
+
     def flatten(self):
         "Flattened list of all pipes involved in the current self.pipeline, with nested pipelines replaced with lists of their pipes."
         def flat(pipes):
@@ -1388,8 +2311,354 @@ class Pipeline(MetaPipe):
         return "Pipeline [" + '] >> ['.join(map(str, self.pipes)) + ']'
     
 
+class _Checkpoint(object):
+    """Progress of Pipeline.run() with checkpointing. Tracks the no. of items read from the source pipe (the 1st one); 
+    saves and restores the position of the source and states of other pipes, pickled, in a checkpoint file."""
+    
+    def __init__(self, pipeline, path):
+        self.pipeline = pipeline
+        self.path = path
+        self.count = 0              # total no. of items read from the source so far, including those processed before resumption
+        self.saved = None           # checkpoint loaded from file, to be applied when iteration starts
+    
+    def pipes(self):
+        "The source and the list of other pipes whose states are saved. Can be called only during iteration, when nested pipelines are set up."
+        source = self.pipeline.pipeline[0]
+        return source, [pipe for pipe in self.pipeline.flatten() if pipe is not source]
+    
+    def resume(self):
+        "Load the checkpoint file, if exists, and seek the source. States of pipes will be restored later, in track()."
+        if not os.path.exists(self.path): return
+        with open(self.path, 'rb') as f: self.saved = pickle.load(f)
+        if not self.pipeline.created:
+            self.pipeline.setup()
+            self.pipeline.created = True
+        position = self.saved['position']
+        if position is not None: self.pipeline.pipeline[0].seek(position)
+    
+    def track(self, source):
+        "Generator that passes through items from 'source', counts them, and when iteration starts, restores the saved checkpoint."
+        it = iter(source)
+        saved, self.saved = self.saved, None
+        if saved:
+            self.count = saved['count']
+            pipes = self.pipes()[1]
+            if [classname(p) for p in pipes] != [name for name, _ in saved['states']]:
+                raise Exception("Checkpoint in '%s' doesn't match the pipeline %s" % (self.path, self.pipeline))
+            for pipe, (_, state) in zip(pipes, saved['states']): pipe.setState(state)
+            if saved['position'] is None:
+                for _ in islice(it, self.count): pass               # the source can't seek? skip items that were processed already
+        for item in it:
+            self.count += 1
+            yield item
+    
+    def save(self):
+        "Write the current position of the source and states of pipes to a temporary file, then replace the checkpoint file with it."
+        source, pipes = self.pipes()
+        position = source.tell() if isinstance(source, Pipe) else None
+        checkpoint = {'count': self.count, 'position': position, 'states': [(classname(p), p.getState()) for p in pipes]}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f: pickle.dump(checkpoint, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.path)
+    
+    def remove(self):
+        if os.path.exists(self.path): os.remove(self.path)
+
+
+class Fused(Pipe):
+    """A sequence of plain Transforms and Filters executed in a single loop, with one generator frame for all of them,
+    instead of one frame (and one _prolog/_epilog, GeneratorExit handler etc.) per pipe.
+    Created automatically by Pipeline.setup() for adjacent fusible pipes; the original pipes are still kept in Pipeline.pipeline,
+    so they can be accessed via pipeline[i] and report their own 'count' and 'yielded' in Pipeline.stats().
+    Input items and results are passed through pipes in the same way as in Transform.__iter__ and Filter.__iter__.
+    """
+    
+    def __init__(self, pipes):
+        self.pipes = pipes
+
+    @staticmethod
+    def fusible(pipe):
+        """Can 'pipe' be fused with neighbors? Only Transforms and Filters that don't override __iter__/__batch_iter__ 
+        (so their behavior is fully defined by process/accept/process_batch), and are not MetaPipes."""
+        if isinstance(pipe, MetaPipe): return False
+        cls = type(pipe)
+        if isinstance(pipe, Transform): base = Transform
+        elif isinstance(pipe, Filter): base = Filter
+        else: return False
+        return cls.__iter__.im_func is base.__iter__.im_func and cls.__batch_iter__.im_func is base.__batch_iter__.im_func
+
+    @staticmethod
+    def fuseAll(pipes):
+        "Returns a copy of 'pipes' list with all runs of 2+ adjacent fusible pipes replaced with Fused pipes."
+        result = []
+        run = []
+        for pipe in pipes + [None]:
+            if pipe is not None and Fused.fusible(pipe): 
+                run.append(pipe)
+                continue
+            if len(run) >= 2: result.append(Fused(run))
+            else: result += run
+            run = []
+            if pipe is not None: result.append(pipe)
+        return result
+    
+    def _prolog(self):
+        "Run _prolog of the inner pipes in reverse order (like in a chain of generators) and return the list of their headers."
+        self.count = self.yielded = 0
+        headers = []
+        for pipe in reversed(self.pipes):
+            headers.append(pipe._prolog())
+            pipe.count = 0
+        headers.reverse()
+        return headers
+    
+    def _epilog(self):
+        "'yielded' of every inner pipe except the last one is equal to 'count' of the next pipe, so it's only set here."
+        for pipe, next in zip(self.pipes, self.pipes[1:]): pipe.yielded = next.count
+        for pipe in self.pipes: pipe._epilog()
+    
+    def _steps(self):
+        """List of triples (pipe, function, isfilter) for every inner pipe. If process() or accept() is not overridden,
+        the inner function, pipe.fun, is called directly to save one method call per item."""
+        steps = []
+        for pipe in self.pipes:
+            cls = type(pipe)
+            isfilter = isinstance(pipe, Filter)
+            if isfilter: plain = (cls.accept.im_func is Filter.accept.im_func and cls.process.im_func is Filter.process.im_func)
+            else: plain = (cls.process.im_func is Transform.process.im_func)
+            if plain: fun = pipe.fun
+            else: fun = pipe.accept if isfilter else pipe.process
+            steps.append((pipe, fun, isfilter))
+        return steps
+    
+    def __iter__(self):
+        headers = self._prolog()
+        try:
+            steps = self._steps()
+            for i in xrange(len(steps)-1, -1, -1):          # headers of downstream pipes are yielded first, like in a chain of generators
+                if headers[i] is None: continue
+                for item in self._run([headers[i]], steps[i+1:]): yield item
+            
+            last = self.pipes[-1]
+            for item in self._run(self.source, steps, last):
+                yield item
+        except GeneratorExit, ex:
+            self._epilog()
+            raise
+        self._epilog()
+    
+    def _run(self, source, steps, last = None):
+        """Generator that passes items from 'source' through 'steps' in a single loop. 
+        'last' is the last pipe of 'steps' whose 'yielded' shall be updated, or None."""
+        for item in source:
+            self.count += 1
+            for pipe, fun, isfilter in steps:
+                pipe.count += 1
+                res = fun(item)
+                if isfilter:
+                    if not res: break
+                elif res is not None:
+                    if res is False: break
+                    item = res
+            else:
+                if last is not None: last.yielded += 1
+                self.yielded += 1
+                yield item
+    
+    def __batch_iter__(self, maxsize = 100):
+        """Batches are passed through process_batch() of consecutive pipes, like in _Functional.__batch_iter__.
+        If none of the pipes overrides process_batch(), every batch is processed item by item in a single loop instead."""
+        headers = self._prolog()
+        try:
+            for i in xrange(len(self.pipes)-1, -1, -1):
+                if headers[i] is None: continue
+                batch = [headers[i]]
+                for pipe in self.pipes[i+1:]:
+                    batch = self._batch(pipe, batch)
+                    if not len(batch): break
+                else: yield batch
+            
+            vectorized = any(type(pipe).process_batch.im_func not in (Transform.process_batch.im_func, Filter.process_batch.im_func) 
+                             for pipe in self.pipes)
+            steps, last = self._steps(), self.pipes[-1]
+            for batch in _batches(self.source, maxsize):
+                if vectorized:
+                    self.count += len(batch)
+                    for pipe in self.pipes:
+                        batch = self._batch(pipe, batch)
+                        if not len(batch): break
+                    else:
+                        self.yielded += len(batch)
+                        yield batch
+                else:
+                    batch = list(self._run(batch, steps, last))
+                    if batch: yield batch
+        except GeneratorExit, ex:
+            self._epilog()
+            raise
+        self._epilog()
+    
+    @staticmethod
+    def _batch(pipe, batch):
+        count = pipe.count + len(batch)
+        out = pipe.process_batch(batch)
+        pipe.count = count
+        pipe.yielded += len(out)
+        return out
+
+    def __str__(self):
+        return "Fused [" + '] >> ['.join(map(str, self.pipes)) + ']'
+
+
 #####################################################################################################################################################
 
+class Profile(object):
+    """Per-stage performance statistics of a Pipeline, collected when pipeline.profile=True and available after iteration
+    in pipeline.profiler. For every pipe of the flattened pipeline reports: wall-clock and CPU time spent in the pipe's own code, 
+    excluding time spent in upstream pipes; no. of input and output items; throughput (input items per second of own wall time);
+    and the peak no. of items held in the pipe's buffers (see Pipe.buffered), if the pipe has any.
+    Times are measured by probes inserted between consecutive pipes, so no pipe needs to be modified. 
+    CPU time is the process time, hence it includes all threads; for pipes that pull their input in a separate thread
+    (Prefetch, Thread, Parallel) own times are approximate.
+    
+    >>> pipeline = Pipeline(Range(1000), Transform(lambda x: x*2), Filter(lambda x: x % 3), profile = True)
+    >>> pipeline.run()
+    >>> [(r['pipe'], r['count'], r['yielded']) for r in pipeline.profiler.records()]
+    [('Range', None, 1000), ('Transform', 1000, 1000), ('Filter', 1000, 666)]
+    """
+    
+    columns = ['wall', 'cpu', 'count', 'yielded', 'rate', 'buffer']
+    
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.probes = []                # _Probe of every pipe in pipeline.pipeline
+        self.nested = []                # nested pipelines whose profiling was switched on for the duration of this run only
+        self.start = time()
+        self.end = None
+    
+    def probe(self, pipe, upstream):
+        probe = _Probe(pipe, upstream)
+        self.probes.append(probe)
+        return probe
+    
+    def nest(self, pipeline):
+        "Switch on profiling of a nested pipeline until stop(), when its 'profile' flag is restored."
+        pipeline.profile = True
+        self.nested.append(pipeline)
+    
+    def stop(self):
+        self.end = time()
+        for pipeline in self.nested: pipeline.profile = False
+        self.nested = []
+    
+    def stages(self):
+        "List of probes of all pipes of the flattened pipeline."
+        stages = []
+        for probe in self.probes:
+            if isinstance(probe.pipe, Pipeline) and probe.pipe.profiler: stages += probe.pipe.profiler.stages()
+            else: stages.append(probe)
+        return stages
+    
+    def records(self):
+        "List of per-stage statistics, as dicts, in the order of pipes in the pipeline."
+        records = []
+        for probe in self.stages():
+            wall, cpu = probe.own()
+            count = getattr(probe.pipe, 'count', None)
+            rate = (count if count is not None else probe.items) / wall if wall else None
+            records.append(OrderedDict([('pipe', str(probe.pipe)), ('wall', wall), ('cpu', cpu), ('count', count), 
+                                        ('yielded', probe.items), ('rate', rate), ('buffer', probe.peak)]))
+        return records
+    
+    def report(self, sort = None):
+        """Formatted table of statistics of all stages. If 'sort' is one of Profile.columns, rows are sorted by this column, 
+        descending, e.g., report('wall') puts the slowest pipes on top."""
+        records = self.records()
+        if sort: records.sort(key = lambda r: r[sort], reverse = True)
+        total = (self.end or time()) - self.start
+        lines = ["Profile of %s, total time %.3f s" % (self.pipeline, total),
+                 "%9s %9s %6s %10s %10s %12s %8s  %s" % ('wall[s]', 'cpu[s]', 'wall%', '#input', '#output', 'items/s', 'buffer', 'pipe')]
+        for r in records:
+            share = 100. * r['wall'] / total if total else 0
+            rate = "%12.1f" % r['rate'] if r['rate'] is not None else "%12s" % '-'
+            lines.append("%9.3f %9.3f %6.1f %10s %10s %s %8s  %s" % (r['wall'], r['cpu'], share, r['count'], r['yielded'], rate, r['buffer'], r['pipe']))
+        return '\n'.join(lines)
+    
+    def dump(self, out, format = 'dast'):
+        "Write records() to 'out' (file object or file name), in DAST (default) or JSON format."
+        close = isstring(out)
+        if close: out = open(out, 'wt')
+        try:
+            records = [dict(r) for r in self.records()]
+            if format == 'json': 
+                import json
+                json.dump(records, out, indent = 2)
+            elif format == 'dast':
+                from nifty.data import dast
+                dast.dump(records, out = out)
+            else: raise Exception("Profile.dump, unknown format: %s" % format)
+        finally:
+            if close: out.close()
+    
+    def __str__(self):
+        return self.report()
+
+class _Probe(object):
+    """Iterable wrapper around a pipe, inserted between the pipe and its consumer in profiled pipelines. 
+    Measures total time spent in the pipe's next(), including the time of upstream pipes, which is then subtracted in own()."""
+    
+    def __init__(self, pipe, upstream = None):
+        self.pipe = pipe
+        self.upstream = upstream if isinstance(upstream, _Probe) else None
+        self.wall = self.cpu = 0.0
+        self.items = 0
+        self.peak = None
+        if isinstance(pipe, Pipe) and type(pipe).buffered.im_func is not Pipe.buffered.im_func: self.buffered = pipe.buffered
+        else: self.buffered = None
+    
+    def own(self):
+        "(wall, cpu) time spent in the pipe itself, excluding upstream."
+        wall, cpu = self.wall, self.cpu
+        if self.upstream: 
+            wall -= self.upstream.wall
+            cpu -= self.upstream.cpu
+        return max(wall, 0.), max(cpu, 0.)
+    
+    def _sample(self):
+        size = self.buffered()
+        if size is not None and size > self.peak: self.peak = size
+    
+    def __iter__(self):
+        it = iter(self.pipe)
+        try:
+            while True:
+                t, c = time(), clock()
+                try: item = next(it)
+                finally:
+                    self.wall += time() - t
+                    self.cpu += clock() - c
+                self.items += 1
+                if self.buffered: self._sample()
+                yield item
+        finally:
+            if hasattr(it, 'close'): it.close()
+    
+    def __batch_iter__(self, maxsize):
+        it = _batches(self.pipe, maxsize)
+        try:
+            while True:
+                t, c = time(), clock()
+                try: batch = next(it)
+                finally:
+                    self.wall += time() - t
+                    self.cpu += clock() - c
+                self.items += len(batch)
+                if self.buffered: self._sample()
+                yield batch
+        finally:
+            it.close()
+
+
 class MultiSource(Pipe):
     pass
 
@@ -1410,13 +2679,29 @@ class Zip(MultiSource):
      - long (default): yield tuples of items, one item from each source; put 'fillvalue' (default=None) if a given source is exhausted; like zip_longest()
      - short: like zip(), truncates output stream to the length of the shortest input stream
      - strict: raise exception if one of the sources is exhausted while another one has still some data
+    >>> Zip(Range(3), [5, 6]) >> List >> Print >> RUN
+    [(0, 5), (1, 6), (2, None)]
+    >>> Zip(Range(3), [5, 6], mode = 'short') >> List >> Print >> RUN
+    [(0, 5), (1, 6)]
     """
     def __init__(self, *sources, **kwargs):
         "kwargs may contain: 'mode' (default 'long'), 'fillvalue' (default None)."
         self.sources = _normalize(sources)
         self.mode = kwargs.get('mode', 'long')
         self.fillvalue = kwargs.get('fillvalue', None)
-    #def iter(self): pass
+        if self.mode not in ('long', 'short', 'strict'): raise Exception("Zip, unknown mode: %s" % self.mode)
+
+    def iter(self):
+        if self.mode == 'short': return izip(*self.sources)
+        if self.mode == 'long': return itertools.izip_longest(*self.sources, fillvalue = self.fillvalue)
+        return self._strict()
+    
+    def _strict(self):
+        missing = object()
+        for items in itertools.izip_longest(*self.sources, fillvalue = missing):
+            for i, item in enumerate(items):                # identity check, 'in' would call __eq__ of items, which may fail (numpy arrays)
+                if item is missing: raise Exception("Zip, input streams have different lengths, source no. %d exhausted earlier" % (i + 1))
+            yield items
     
 class MergeSort(MultiSource):
     """Merge multiple sorted inputs into a single sorted output. Like heapq.merge(), but wrapped up in a Pipe. 
@@ -1429,6 +2714,132 @@ class MergeSort(MultiSource):
     def iter(self):
         for item in heapq.merge(*self.sources): yield item
 
+class Join(MultiSource):
+    """Relational join of two streams of items, 'left' and 'right', by key. Yields (leftitem, rightitem) pairs for every pair of items with equal keys.
+    If only 1 source is given, it's the right stream, and the left one is the pipe's input stream: left >> Join(right, ...).
+    'key' is a function that calculates the key of an item, or a pair of functions, for left and right items respectively;
+    if None, items themselves are the keys.
+    'how': 
+     - inner (default): only matching pairs are yielded
+     - left: every left item is yielded at least once, paired with None if there's no match on the right side
+     - outer: like 'left', but additionally right items without a match are yielded as (None, rightitem)
+    'algorithm':
+     - hash (default): one side is loaded into a hash table, the other one is streamed. The smaller side is loaded 
+       if lengths of both sources are known (lists), otherwise the right side is loaded (typically: reference data). 
+       Output order follows the streamed side.
+     - merge: both sources must be sorted by key already; they are streamed together and only a group of items
+       with the same key is kept in memory at a time. Output is sorted by key.
+    
+    >>> people = [(1, 'ala'), (2, 'ola'), (3, 'ela')]
+    >>> pets   = [(1, 'kot'), (1, 'pies'), (3, 'rybka'), (4, 'chomik')]
+    >>> Join(people, pets, key = lambda x: x[0]) >> List >> Print >> RUN
+    [((1, 'ala'), (1, 'kot')), ((1, 'ala'), (1, 'pies')), ((3, 'ela'), (3, 'rybka'))]
+    >>> Join(people, pets, key = lambda x: x[0], how = 'outer', algorithm = 'merge') >> List >> Print >> RUN
+    [((1, 'ala'), (1, 'kot')), ((1, 'ala'), (1, 'pies')), ((2, 'ola'), None), ((3, 'ela'), (3, 'rybka')), (None, (4, 'chomik'))]
+    >>> PIPE >> [1, 2, 3, 4] >> Join([2, 3, 3], how = 'left') >> List >> Print >> RUN
+    [(1, None), (2, 2), (3, 3), (3, 3), (4, None)]
+    """
+    
+    class __knobs__:
+        key       = None
+        how       = 'inner'
+        algorithm = 'hash'
+    
+    def __init__(self, *sources, **knobs):
+        if len(sources) not in (1, 2): raise Exception("Join takes 1 or 2 sources, %d given" % len(sources))
+        self.initKnobs(**knobs)
+        if self.how not in ('inner', 'left', 'outer'): raise Exception("Join: incorrect value of 'how': %s" % self.how)
+        if self.algorithm not in ('hash', 'merge'): raise Exception("Join: unknown algorithm '%s'" % self.algorithm)
+        self.sources = _normalize(sources)
+    
+    def _keys(self):
+        key = self.key
+        if islist(key): return key
+        if key is None: key = lambda item: item
+        return key, key
+    
+    def iter(self):
+        if len(self.sources) == 2: left, right = self.sources
+        else: left, right = self.source, self.sources[0]
+        lkey, rkey = self._keys()
+        if self.algorithm == 'merge': return self._merge(left, right, lkey, rkey)
+        
+        # build the hash table on the left side only if it's known to be smaller
+        if isinstance(left, Collection) and isinstance(right, Collection):
+            try: 
+                if len(left.data) < len(right.data): return self._hashLeft(left, right, lkey, rkey)
+            except TypeError: pass
+        return self._hashRight(left, right, lkey, rkey)
+    
+    @staticmethod
+    def _table(items, key):
+        table = {}
+        for item in items:
+            k = key(item)
+            group = table.get(k)
+            if group is None: table[k] = [item]
+            else: group.append(item)
+        return table
+    
+    def _hashRight(self, left, right, lkey, rkey):
+        table = self._table(right, rkey)
+        matched = set() if self.how == 'outer' else None
+        inner = (self.how == 'inner')
+        for litem in left:
+            k = lkey(litem)
+            group = table.get(k)
+            if group is None:
+                if not inner: yield litem, None
+                continue
+            if matched is not None: matched.add(k)
+            for ritem in group: yield litem, ritem
+        if matched is not None:
+            for k, group in table.iteritems():
+                if k in matched: continue
+                for ritem in group: yield None, ritem
+    
+    def _hashLeft(self, left, right, lkey, rkey):
+        table = self._table(left, lkey)
+        matched = set() if self.how != 'inner' else None
+        outer = (self.how == 'outer')
+        for ritem in right:
+            k = rkey(ritem)
+            group = table.get(k)
+            if group is None:
+                if outer: yield None, ritem
+                continue
+            if matched is not None: matched.add(k)
+            for litem in group: yield litem, ritem
+        if matched is not None:
+            for k, group in table.iteritems():
+                if k in matched: continue
+                for litem in group: yield litem, None
+    
+    def _merge(self, left, right, lkey, rkey):
+        END = object()
+        lgroups = itertools.groupby(left, lkey)
+        rgroups = itertools.groupby(right, rkey)
+        lk, lgroup = next(lgroups, (END, None))
+        rk, rgroup = next(rgroups, (END, None))
+        keepleft, keepright = (self.how != 'inner'), (self.how == 'outer')
+        
+        while lk is not END or rk is not END:
+            if rk is END or (lk is not END and lk < rk):
+                if keepleft:
+                    for litem in lgroup: yield litem, None
+                lk, lgroup = next(lgroups, (END, None))
+            elif lk is END or rk < lk:
+                if keepright:
+                    for ritem in rgroup: yield None, ritem
+                rk, rgroup = next(rgroups, (END, None))
+            else:
+                rlist = list(rgroup)
+                for litem in lgroup:
+                    for ritem in rlist: yield litem, ritem
+                lk, lgroup = next(lgroups, (END, None))
+                rk, rgroup = next(rgroups, (END, None))
+            if not (keepleft or keepright) and (lk is END or rk is END): break
+
 class Ensemble(MetaPipe, Transform):   # DRAFT
     ""
     def __init__(self, *algs, **knobs):
@@ -1451,7 +2862,7 @@ class Ensemble(MetaPipe, Transform):   # DRAFT
         return vote
         
 
-class Parallel(MetaPipe):   # DRAFT
+class Parallel(MetaPipe):
     """Connects multiple pipes as parallel routes from a single source and no destination.
     Each parallel route is wrapped up in a Thread object, so that 'push' interface can be used
     to feed data to every route. Output items - if generated by the routes - are ignored.
@@ -1460,9 +2871,72 @@ class Parallel(MetaPipe):   # DRAFT
     when some thread hasn't consumed it yet - take this into account when monitoring side effects
     of execution on particular routes. However, it's guaranteed that when all iteration ends,
     all the threads have already finished their execution.
+    The same item objects are passed to all routes, thus the routes must NOT modify input items.
+    Input queue of every route holds up to 'buffer' items; when it's full, reading of the source is suspended.
+    Exceptions raised inside routes are re-raised in the calling thread.
+    
+    >>> l1, l2 = List(), List()
+    >>> Range(3) >> Parallel(Transform(lambda x: x*10) >> l1, l2) >> List >> Print >> RUN
+    [0, 1, 2]
+    >>> l1.items, l2.items
+    ([0, 10, 20], [0, 1, 2])
     """
+    
+    buffer  = 10            # max. no. of items waiting in the input queue of each route
+    threads = None          # Thread objects running the routes during iteration
+    
     def __init__(self, *pipes, **knobs):
         self.pipes = list(pipes)
+        self.buffer = knobs.pop('buffer', self.buffer)
+
+    def setKnobs(self, knobs = {}, strict = False, **kwargs):
+        if kwargs:
+            knobs = knobs.copy()
+            knobs.update(kwargs)
+        super(Parallel, self).setKnobs(knobs, strict)
+        for pipe in self.pipes:
+            if isinstance(pipe, Cell): pipe.setKnobs(knobs, strict)
+
+    def iter(self):
+        self.threads = [Thread(Pipeline(pipe), insize = self.buffer) for pipe in _normalize(self.pipes)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            self.count = 0
+            for item in self.source:
+                self.count += 1
+                for thread in self.threads:
+                    if thread.error: self._finish()
+                    thread.put(item)
+                yield item
+        finally:
+            self._finish()
+
+    def _finish(self):
+        "Terminate input streams of all routes, wait until the routes finish processing, re-raise the 1st exception of a route, if any."
+        threads = self.threads
+        if threads is None: return
+        self.threads = None
+        for thread in threads: thread.end()
+        for thread in threads: thread.join()
+        for thread in threads:
+            if thread.error: raise thread.error[0], thread.error[1], thread.error[2]
+
+    def _epilog(self):
+        self._finish()                          # when iteration was closed early, the routes may still be running
+        super(Parallel, self)._epilog()
+
+    def buffered(self):
+        "Total no. of items waiting in input queues of the routes."
+        threads = self.threads
+        return sum(thread.input.qsize() for thread in threads) if threads else None
+
+    def stats(self):
+        lines = [super(Parallel, self).stats()]
+        for pipe in self.pipes:
+            if isinstance(pipe, Pipe): lines.append(pipe.stats())
+        return '\n'.join(lines)
 
 #####################################################################################################################################################
 
@@ -1476,6 +2950,7 @@ class Grid(MetaOptimize):
     Runs in mixed serial-parallel mode, depending on 'maxThreads' setting. 
     In parallel mode, the algorithm must NOT deep-modify data items, otherwise there will be interference 
     between concurrent threads (items are only shallow-copied for each thread). 
+    With copyData='freeze', this is enforced: all threads share one read-only copy of each item.
     For confirmation, after evaluating different knob settings and choosing the best one, you should execute 
     the pipe with this setting outside Grid and see if it produces the same results as inside Grid.
     No output produced, only empty stream.
@@ -1487,7 +2962,18 @@ class Grid(MetaOptimize):
     threadBuffer = 10               # length of input queue in each thread; 1 enforces perfect alignment of threads execution; 
                                     # 0: no alignment, queues can get big when input data are produced faster than consumed
     copyPipe     = True             # shall we make a separate deep copy of the pipe for each run?
-    copyData     = True             # shall we make separate deep copies of data items for each parallel run? no copy in serial mode
+    copyData     = True             # shall we make separate deep copies of data items for each parallel run? no copy in serial mode;
+                                    # 'freeze': make one read-only copy of every item (see util.freeze) and share it between all parallel runs,
+                                    # any attempt to modify the item inside a run raises TypeError
+    backend      = 'thread'         # 'thread': parallel runs executed in threads of this process, fed with items from a single scan over input data;
+                                    # 'process': runs distributed over a pool of 'maxThreads' worker processes (None: no. of CPUs),
+                                    # each run reads the source anew, like in serial mode; the source must be re-iterable
+    results      = None             # with 'process' backend: list of (knobs, pipe) pairs, one for each run, where 'pipe' is the final state 
+                                    # of the pipe after the run, sent back from the worker; or None if the pipe couldn't be pickled
+    cache        = None             # in serial mode and with 'process' backend: optional storage of a Cache that reads input data once 
+                                    # and replays it in all runs, for sources that are expensive to re-read; None: the source is re-read in every run;
+                                    # 'memory': fast, but items are shared between runs; 'disk': every run gets fresh copies of items, 
+                                    # but items must be picklable and pay for disk I/O
     
     def __init__(self, pipe, **kwargs):
         #"""'space', if present, is a Cartesian or another Space instance, 
@@ -1500,6 +2986,9 @@ class Grid(MetaOptimize):
         self.threadBuffer = kwargs.pop('threadBuffer', self.threadBuffer)
         self.copyPipe = kwargs.pop('copyPipe', self.copyPipe)
         self.copyData = kwargs.pop('copyData', self.copyData)
+        self.backend = kwargs.pop('backend', self.backend)
+        self.cache = kwargs.pop('cache', self.cache)
+        if self.backend not in ('thread', 'process'): raise Exception("Grid, unknown backend: %s" % self.backend)
         
         knobs = kwargs
         self.space = Cartesian(*knobs.values())             # value space of all possible knob values
@@ -1518,11 +3007,30 @@ class Grid(MetaOptimize):
         
     def iter(self):
         self.done = 0
-        if self.maxThreads is None or self.maxThreads > 1:
+        if self.backend == 'process':
+            with self.cachedSource(): self.iterProcesses()
+        elif self.maxThreads is None or self.maxThreads > 1:
             self.iterParallel()
         else:
-            self.iterSerial()
+            with self.cachedSource(): self.iterSerial()
         return; yield                                       # to make this method work as a generator (only an empty one)
+    
+    @contextmanager
+    def cachedSource(self):
+        """Context in which self.source is replaced with a Cache over it, filled with data before the first run, 
+        so that the source is read only once in modes that would otherwise read it anew in every run."""
+        source = self.source
+        if not self.cache or len(self.space) <= 1:
+            yield
+            return
+        self.source = cache = Cache(self.cache)
+        cache.source = source
+        try:
+            cache.run()
+            yield
+        finally:
+            cache.clear()
+            self.source = source
         
     def iterSerial(self):
         with self.printlock: print "Grid: %d serial runs to be executed..." % len(self.space)
@@ -1542,7 +3050,7 @@ class Grid(MetaOptimize):
         def knobsGroups():
             "Partitions stream generated by knobsStream() into groups of up to 'maxThreads' size each."
             if not self.maxThreads: 
-                yield knobsStream()
+                yield list(knobsStream())
                 return
             group = []
             for knobs in knobsStream():
@@ -1556,6 +3064,30 @@ class Grid(MetaOptimize):
             self.scanParallel(kgroup)
             self.done += len(kgroup)
 
+    def iterProcesses(self):
+        "Distribute all runs over a pool of worker processes. Workers get a copy of 'self' through fork(), the runs' knobs and results are pickled."
+        workers = self.maxThreads or multiprocessing.cpu_count()
+        with self.printlock: print "Grid: %d runs to be executed in %d processes..." % (len(self.space), workers)
+        runs = [self.createKnobs(self.startID + i, v) for i, v in enumerate(self.space)]
+        self.results = []
+        
+        pool = multiprocessing.Pool(workers, _initGrid, (self,))
+        try:
+            for knobs, pipe, count, stats in pool.imap(_runGrid, runs):
+                self.done += 1
+                self.count = count
+                self.results.append((knobs, pipe))
+                self.printKnobs(knobs)
+                if self.verbose: 
+                    with self.printlock: print stats
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        with self.printlock: print "Grid, %d runs done." % self.done
+    
     def scanSerial(self, value, ID):
         """Single scan over input data, with items passed directly to the single pipe being executed. 
         No parallelism, no multi-threading, no pipe copying.
@@ -1571,15 +3103,18 @@ class Grid(MetaOptimize):
     
     def scanParallel(self, knobsGroup):
         "Single scan over input data, with each item fed to a group of parallel threads."
-        with self.printlock: print "Grid, starting next parallel scan for %d runs beginning with ID=%s..." % (len(knobsGroup), knobsGroup[0][0][1])
+        with self.printlock: print "Grid, starting next parallel scan for %d runs beginning with ID=%s..." % (len(knobsGroup), knobsGroup[0][self.runID])
         threads = self.createThreads(knobsGroup)
-        duplicate = deepcopy if self.copyData else lambda x:x
+        if self.copyData == 'freeze': share, duplicate = freeze, None     # one frozen copy shared by all threads
+        elif self.copyData: share, duplicate = None, deepcopy               # separate copy for each thread
+        else: share = duplicate = None
 
         self.count = 0
         for item in self.source: 
             self.count += 1
+            if share: item = share(item)
             for _, thread in threads:                           # feed input data to each pipe in parallel
-                thread.put(duplicate(item))
+                thread.put(duplicate(item) if duplicate else item)
         
         self.closeThreads(threads)
 
@@ -1593,9 +3128,12 @@ class Grid(MetaOptimize):
         return threads
         
     def closeThreads(self, threads):
+        for _, thread in threads:           # terminate input streams of all pipes...
+            thread.end()
+        for _, thread in threads:           # ...and wait until every pipe has processed its last item and finished
+            thread.join()
         for _, thread in threads:
-            thread.emptyFeed()              # wait until all pipes eat up all remaining input items;
-        sleep(1)                            # note: some pipes may still be processing the last item! thus sleep()
+            if thread.error: raise thread.error[0], thread.error[1], thread.error[2]
         
         for _, thread in threads:           # if verbose, print stats of #items 
             self.report(thread.pipe)
@@ -1603,8 +3141,6 @@ class Grid(MetaOptimize):
         with self.printlock: print "Grid, %d runs done." % (self.done + len(threads))
         for knobs, thread in threads:
             self.printKnobs(knobs)
-            thread.end()
-            thread.join()
 
     def report(self, pipe):
         if not self.verbose: return
@@ -1616,6 +3152,25 @@ class Grid(MetaOptimize):
             print ' '.join("%s=%s" % knob for knob in knobs.iteritems())        # space-separated list of knob values
     
 
+_workerGrid = None              # inside a Grid worker process: the Grid object, inherited from the parent process
+
+def _initGrid(grid):
+    "Runs in a Grid worker process on its start."
+    global _workerGrid
+    _workerGrid = grid
+
+def _runGrid(knobs):
+    """Runs in a Grid worker process. Executes one run of the grid's pipe with given knobs, over the grid's source.
+    Returns (knobs, pipe, count, stats), where 'pipe' is None if the pipe can't be pickled and sent back."""
+    grid = _workerGrid
+    pipe = grid.createPipe(knobs, forceCopy = True)
+    PIPE >> grid.source >> pipe >> RUN
+    try: pickle.dumps(pipe, pickle.HIGHEST_PROTOCOL)
+    except Exception: result = None
+    else: result = pipe
+    return knobs, result, pipe.count, pipe.stats()
+    
+
 class Evolution(MetaOptimize):
     "Evolutionary algorithm for (meta-)optimization of a given signal of a pipe through tuning of its knobs."
     
@@ -1735,15 +3290,22 @@ class Thread(threading.Thread, Wrapper):
     
     END = object()      # token to be put into a queue (input or output) to indicate end of data stream
     
+    error   = None      # exc_info() of an exception raised inside the thread by the pipe, to be re-raised in the calling thread
+    stopped = False     # set by the calling thread to request that the thread stops pulling output items from the pipe
+    ended   = False     # has the calling thread already received the END token from the output queue?
+    
     class Feed(Pipe):
         "A data-pipe wrapper around threading queue for input data."
         def __init__(self, queue):
             self.queue = queue
+        ended = False       # True when END token was received
         def __iter__(self):
             while True: 
                 item = self.queue.get()
                 self.queue.task_done()
-                if item is Thread.END: break
+                if item is Thread.END: 
+                    self.ended = True
+                    break
                 yield item
         def join(self):
             "Block until all items in the feed have been retrieved. Note: more items can still be added afterwards."
@@ -1768,12 +3330,21 @@ class Thread(threading.Thread, Wrapper):
         else:
             pipeline = self.pipe
             
-        # run the pipeline, optionally pushing output items to self.output
-        if self.output:
-            for item in pipeline: self.output.put(item)
-            self.output.put(Thread.END)
-        else:
-            for item in pipeline: pass
+        # run the pipeline, optionally pushing output items to self.output;
+        # exceptions are passed to the calling thread, which receives END token in any case
+        items = iter(pipeline)
+        try:
+            for item in items: 
+                if self.stopped: break
+                if self.output: self.output.put(item)
+        except Exception:
+            self.error = sys.exc_info()
+            if self.feed and not self.feed.ended:       # consume remaining input, so that the calling thread never blocks on put()
+                for item in self.feed: pass
+        finally:
+            close = getattr(items, 'close', None)
+            if close: close()
+            if self.output: self.output.put(Thread.END)
     
     # to be used by calling thread...
     
@@ -1785,17 +3356,465 @@ class Thread(threading.Thread, Wrapper):
     
     def emptyFeed(self): self.feed.join()
     
+    def stop(self):
+        """Request the thread to stop pulling items from the pipe and wait until it terminates. 
+        Output items not yet retrieved are discarded. To be used by the calling thread."""
+        self.stopped = True
+        if self.output:
+            while not self.ended:
+                if self.output.get() is Thread.END: self.ended = True
+        self.join()
+    
     def iter(self):
         if self.source: 
             raise Exception("Pipe of class Thread can't be used with a source attached. It can't synchronize input and output by itself.")
         while True:
             item = self.get()
-            if item is Thread.END: break
+            if item is Thread.END: 
+                self.ended = True
+                if self.error: raise self.error[0], self.error[1], self.error[2]
+                break
             yield item
+
+
+#####################################################################################################################################################
+
+class ProcessMap(Wrapper):
+    """Executes a Transform or Filter in a pool of worker processes, to spread CPU-bound processing over multiple cores.
+    Input items are read from the source in chunks of 'chunksize' items, sent to workers, and output items
+    are yielded in the original order (ordered=True), or in the order of chunk completion (ordered=False, faster).
+    Every worker holds its own deep copy of the inner pipe, made with Cell.copy() once per worker process;
+    its open() is called once when the worker starts, close() is never called inside workers.
+    Input and output items must be picklable. The inner pipe itself is passed to workers by fork(),
+    so it may contain lambdas and other non-picklable functions.
+    >>> Range(6) >> ProcessMap(Transform(lambda x: x*x), workers = 2, chunksize = 2) >> List >> Print >> RUN
+    [0, 1, 4, 9, 16, 25]
+    """
+
+    workers   = None            # no. of worker processes; None for the no. of CPUs
+    chunksize = 100             # no. of items sent to a worker in one task
+    ordered   = True            # shall output items be yielded in the same order as input items?
+    buffer    = 2               # max. no. of chunks being processed or waiting for pickup, per worker; bounds memory usage
+
+    def __init__(self, pipe, workers = None, chunksize = None, ordered = None, buffer = None):
+        if issubclass(pipe, Pipe): pipe = pipe()
+        if not isinstance(pipe, (Transform, Filter)):
+            raise Exception("ProcessMap can only wrap a Transform or Filter, not %s" % pipe)
+        self.pipe = pipe
+        if workers is not None: self.workers = workers
+        if chunksize is not None: self.chunksize = chunksize
+        if ordered is not None: self.ordered = ordered
+        if buffer is not None: self.buffer = buffer
+
+    def iter(self):
+        pipe = self.pipe
+        pipe.count = pipe.yielded = 0
+        pool = multiprocessing.Pool(self.workers, _initWorker, (pipe,))
+        maxtasks = max(1, self.buffer * (self.workers or multiprocessing.cpu_count()))
+        done = Queue() if not self.ordered else None            # in unordered mode, results are pushed here by pool callbacks
+        pending = deque()                                       # in ordered mode, AsyncResults of submitted chunks
+        submitted = collected = 0
+        aborted = True
+        try:
+            self.count = 0
+            source = iter(self.source)
+            while True:
+                # submit new chunks until the buffer is full or input data are exhausted
+                while source is not None and submitted - collected < maxtasks:
+                    chunk = list(islice(source, self.chunksize))
+                    if not chunk:
+                        source = None
+                        break
+                    task = (self.count, chunk)
+                    self.count += len(chunk)
+                    if self.ordered: pending.append(pool.apply_async(_processChunk, (task,)))
+                    else: pool.apply_async(_processChunk, (task,), callback = done.put)
+                    submitted += 1
+                if submitted == collected: break
+
+                # pick up the next chunk of results
+                items, count, error = pending.popleft().get() if self.ordered else done.get()
+                collected += 1
+                if error: raise Exception("ProcessMap, exception in a worker process of %s:\n%s" % (self, error))
+                pipe.count += count
+                pipe.yielded += len(items)
+                for item in items: yield item
+            aborted = False
+        finally:
+            if aborted: pool.terminate()
+            else: pool.close()
+            pool.join()
+
+    def buffered(self):
+        "No. of input items sent to workers, but not yet collected back."
+        return self.count - self.pipe.count if self.iterating else None
+
+    def stats(self):
+        return "No. of input/output data items of %s: %s, %s  (%s workers)" % (self, self.count, self.yielded, self.workers or multiprocessing.cpu_count())
+
+    def __str__(self):
+        return "%s [%s]" % (super(ProcessMap, self).__str__(), self.pipe)
+
+
+class AsyncTransform(Transform):
+    """Transform for I/O-bound processing (web requests, database queries...), which calls process() on up to 'inflight' items 
+    concurrently, in a pool of 'workers' threads, so that waiting for I/O of different items overlaps. Output items are yielded 
+    in the original order (ordered=True), or as soon as they are ready (ordered=False). Results of process() are interpreted 
+    like in Transform. Exceptions raised in process() are re-raised in the caller. Surrounding pipes are executed as usual, 
+    in the caller's thread, so AsyncTransform can be put anywhere in a regular pipeline: source >> AsyncTransform(fetch) >> ...
+    process() must be thread-safe; self.count is updated in the caller's thread, when results are collected.
+    >>> Range(6) >> AsyncTransform(lambda x: x*x, workers = 3) >> List >> Print >> RUN
+    [0, 1, 4, 9, 16, 25]
+    """
+    class __knobs__:
+        fun      = None         # repeated here to keep it the 1st knob, so that AsyncTransform(fun, ...) works like Transform(fun)
+        workers  = 10           # no. of threads that execute process()
+        inflight = None         # max. no. of items being processed or waiting for pickup; 2*workers if None
+        ordered  = True         # shall output items be yielded in the same order as input items?
+    
+    def __iter__(self):
+        header = self._prolog()
+        if header is not None: yield header
+        pool = ThreadPool(self.workers)
+        inflight = self.inflight or 2 * self.workers
+        done = Queue() if not self.ordered else None            # in unordered mode, results are pushed here by pool callbacks
+        pending = deque()                                       # in ordered mode, AsyncResults of submitted items
+        submitted = 0
+        try:
+            self.count = 0
+            source = iter(self.source)
+            while True:
+                while source is not None and submitted - self.count < inflight:
+                    try: item = source.next()
+                    except StopIteration:
+                        source = None
+                        break
+                    if self.ordered: pending.append(pool.apply_async(_callAsync, (self.process, item)))
+                    else: pool.apply_async(_callAsync, (self.process, item), callback = done.put)
+                    submitted += 1
+                if submitted == self.count: break
+                
+                item, res, error = pending.popleft().get() if self.ordered else done.get()
+                self.count += 1
+                if error: raise error[0], error[1], error[2]
+                if res is not False:
+                    self.yielded += 1
+                    yield item if res is None else res
+        except GeneratorExit, ex:
+            pool.terminate()
+            self._epilog()
+            raise
+        except:
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
+        self._epilog()
+    
+    def __batch_iter__(self, maxsize = 100):
+        "Batches are formed from items yielded by __iter__, because process_batch() would process items of a batch sequentially."
+        return Pipe.__batch_iter__(self, maxsize)
+
+def _callAsync(fun, item):
+    "Runs in an AsyncTransform thread. Returns (item, result, exc_info-or-None), because unordered callbacks can't pass errors."
+    try: return item, fun(item), None
+    except Exception: return item, None, sys.exc_info()
+
+
+_workerPipe = None              # inside a ProcessMap worker process: a local copy of the pipe being executed
+
+def _initWorker(pipe):
+    "Runs in a ProcessMap worker process on its start."
+    global _workerPipe
+    _workerPipe = pipe.copy()
+    _workerPipe._prolog()
+
+def _processChunk(task):
+    """Runs in a ProcessMap worker process. Applies the worker's pipe to a chunk of items.
+    Returns a triple: (output items, no. of input items, formatted traceback or None)."""
+    start, chunk = task
+    pipe = _workerPipe
+    out = []
+    try:
+        if isinstance(pipe, Filter):
+            for i, item in enumerate(chunk):
+                pipe.count = start + i + 1
+                if pipe.accept(item): out.append(item)
+        else:
+            for i, item in enumerate(chunk):
+                pipe.count = start + i + 1
+                res = pipe.process(item)
+                if res is not False: out.append(item if res is None else res)
+    except Exception:
+        return None, len(chunk), traceback.format_exc()
+    return out, len(chunk), None
+
+
+class Remote(Wrapper):
+    """Executes a Transform or Filter in worker processes that listen on Unix sockets (path string) or TCP sockets of localhost, 
+    ('127.0.0.1', port), to spread processing over independently started and long-running workers. The inner pipe is shipped to every worker
+    as DAST code (see Cell serialization), so it must be DAST-encodable: an instance of a module-level class, with knobs 
+    that are plain data or module-level functions (no lambdas). Input items are sent in chunks of 'chunksize' items, 
+    with at most 'buffer' chunks pending per worker (backpressure); output items are yielded in the original order (ordered=True), 
+    or in the order of chunk completion (ordered=False). Items travel pickled, in length-prefixed messages of multiprocessing.connection, 
+    so they must be picklable. If a worker's connection breaks, Remote tries to reconnect ('retries' times, 'delay' seconds apart) 
+    and re-sends chunks that were pending on that worker; if the worker is gone, its chunks are redistributed to other workers.
+    Workers are started with Remote.serve(address, authkey), or in child processes with Remote.spawn(n).
+    Workers unpickle and execute whatever they receive, so every connection is authenticated first with the HMAC challenge 
+    of multiprocessing.connection, using a secret 'authkey' shared by the client and workers; by default, the authkey 
+    of the current process (multiprocessing.current_process().authkey), which is inherited by workers started with spawn().
+    Traffic is not encrypted, so non-local TCP addresses are rejected, both by workers and clients. 
+    >>> import math
+    >>> addresses, procs = Remote.spawn(2)
+    >>> Range(6) >> Remote(Transform(math.factorial), addresses, chunksize = 2) >> List >> Print >> RUN
+    [1, 1, 2, 6, 24, 120]
+    >>> for p in procs: p.terminate()
+    """
+
+    workers   = None            # list of worker addresses: ('host', port) tuples for TCP, path strings for Unix sockets
+    chunksize = 100             # no. of items sent to a worker in one message
+    ordered   = True            # shall output items be yielded in the same order as input items?
+    buffer    = 2               # max. no. of chunks sent to a worker and not yet collected back; bounds memory usage
+    retries   = 3               # no. of reconnection attempts after a worker's connection breaks
+    delay     = 1.0             # delay in seconds between reconnection attempts
+    authkey   = None            # secret key for authentication of workers and the client; None: multiprocessing.current_process().authkey
+
+    def __init__(self, pipe, workers, chunksize = None, ordered = None, buffer = None, retries = None, delay = None, authkey = None):
+        if issubclass(pipe, Pipe): pipe = pipe()
+        if not isinstance(pipe, (Transform, Filter)):
+            raise Exception("Remote can only wrap a Transform or Filter, not %s" % pipe)
+        if not workers: raise Exception("Remote, no worker addresses given")
+        for address in workers: _checkAddress(address)
+        self.pipe = pipe
+        self.workers = list(workers)
+        if chunksize is not None: self.chunksize = chunksize
+        if ordered is not None: self.ordered = ordered
+        if buffer is not None: self.buffer = buffer
+        if retries is not None: self.retries = retries
+        if delay is not None: self.delay = delay
+        if authkey is not None: self.authkey = authkey
+
+    def iter(self):
+        from nifty.data import dast
+        pipe = self.pipe
+        pipe.count = pipe.yielded = 0
+        code = dast.encode(pipe, mode = 0)
+        authkey = self.authkey or multiprocessing.current_process().authkey
+        conns = [_Connection(addr, authkey, code) for addr in self.workers]
+        for conn in conns: self._reconnect(conn)
         
+        chunks = {}             # chunks sent and not yet collected: index -> (start, items); kept for re-sending after failures
+        retry = deque()         # indices of chunks to be re-sent after a worker failure
+        results = {}            # in ordered mode, output items of collected chunks waiting for their turn: index -> items
+        submitted = yielded = 0
+        try:
+            self.count = 0
+            source = iter(self.source)
+            while True:
+                # send chunks to workers with free buffer space; failed chunks first, then new ones from the source
+                while True:
+                    alive = [c for c in conns if c.conn]
+                    if not alive: raise Exception("Remote, all workers of %s are unreachable: %s" % (self, self.workers))
+                    conn = min(alive, key = lambda c: len(c.pending))
+                    if len(conn.pending) >= self.buffer: break
+                    if retry: index = retry.popleft()
+                    elif source is not None:
+                        items = list(islice(source, self.chunksize))
+                        if not items:
+                            source = None
+                            continue
+                        index = submitted
+                        chunks[index] = (self.count, items)
+                        self.count += len(items)
+                        submitted += 1
+                    else: break
+                    conn.pending.append(index)
+                    try: conn.send(('chunk', index) + chunks[index])
+                    except IOError: self._fail(conn, retry)
+                if not chunks: break
+                
+                # collect results from the workers that have some sent back already
+                busy = [c for c in conns if c.conn and c.pending]
+                ready, _, _ = select.select(busy, [], [])
+                for conn in ready:
+                    try: index, items, count, error = conn.recv()
+                    except (IOError, EOFError): 
+                        self._fail(conn, retry)
+                        continue
+                    conn.pending.remove(index)
+                    del chunks[index]
+                    if error: raise Exception("Remote, exception in a worker process of %s at %s:\n%s" % (self, conn.address, error))
+                    pipe.count += count
+                    pipe.yielded += len(items)
+                    if self.ordered: results[index] = items
+                    else: 
+                        for item in items: yield item
+                while yielded in results:
+                    for item in results.pop(yielded): yield item
+                    yielded += 1
+        finally:
+            for conn in conns: conn.close()
+
+    def _reconnect(self, conn):
+        "Try to (re)connect to a worker 'retries' times. On failure, conn.conn is left None. A wrong authkey is not retried."
+        for attempt in xrange(self.retries + 1):
+            if attempt: sleep(self.delay)
+            try: return conn.connect()
+            except (IOError, EOFError): pass
+    
+    def _fail(self, conn, retry):
+        "Handle a broken connection: reconnect and schedule re-sending of all its pending chunks."
+        conn.close()
+        retry.extend(conn.pending)
+        conn.pending = []
+        self._reconnect(conn)
+
+    def buffered(self):
+        "No. of input items sent to workers, but not yet collected back."
+        return self.count - self.pipe.count if self.iterating else None
+
+    def stats(self):
+        return "No. of input/output data items of %s: %s, %s  (%s workers)" % (self, self.count, self.yielded, len(self.workers))
+
+    def __str__(self):
+        return "%s [%s]" % (super(Remote, self).__str__(), self.pipe)
+
+    @staticmethod
+    def serve(address, authkey):
+        """Run a worker that listens on a given address - a Unix socket path, or ('127.0.0.1', port) - and executes pipes 
+        sent by Remote clients that know the 'authkey', one client at a time. Never returns."""
+        _serveRemote(_listen(address, authkey))
+    
+    @staticmethod
+    def spawn(n, tcp = False, authkey = None):
+        """Start 'n' local worker processes listening on Unix sockets in a temporary folder, or on TCP ports of localhost (tcp=True).
+        Returns (addresses, processes). Workers accept clients that know the 'authkey', by default the authkey of the current process.
+        Workers are daemonic processes: they're killed when the parent process exits, or earlier by process.terminate(). 
+        The temporary folder of Unix sockets is removed when the parent process exits."""
+        authkey = authkey or multiprocessing.current_process().authkey
+        addresses, procs = [], []
+        folder = None
+        if not tcp:
+            folder = tempfile.mkdtemp(prefix = 'nifty_remote_')
+            atexit.register(shutil.rmtree, folder, True)
+        for i in xrange(n):
+            address = ('127.0.0.1', 0) if tcp else os.path.join(folder, 'worker%d' % i)
+            ready, child = multiprocessing.Pipe(duplex = False)
+            proc = multiprocessing.Process(target = _spawnedWorker, args = (address, authkey, child))
+            proc.daemon = True
+            proc.start()
+            child.close()
+            try: address = ready.recv()                     # wait until the worker is bound, so that clients can connect instantly
+            except EOFError: raise Exception("Remote, worker process failed to start listening on %s" % (address,))
+            finally: ready.close()
+            addresses.append(address)
+            procs.append(proc)
+        return addresses, procs
+
+class _Connection(object):
+    """Client side of a connection to a Remote worker: an authenticated multiprocessing.connection.Connection.
+    Client() of multiprocessing.connection is not used, because it keeps retrying a refused connection for 20 seconds,
+    while Remote handles reconnection itself."""
+    def __init__(self, address, authkey, code):
+        self.address = address
+        self.authkey = authkey
+        self.code = code            # DAST code of the pipe to be sent to the worker after connecting
+        self.conn = None
+        self.pending = []           # indices of chunks sent and not yet collected, in the order of sending
+    def connect(self):
+        import _multiprocessing
+        sock = socket.socket(socket.AF_UNIX if isstring(self.address) else socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.address)
+            conn = _multiprocessing.Connection(os.dup(sock.fileno()))
+        finally: sock.close()
+        try:
+            answer_challenge(conn, self.authkey)
+            deliver_challenge(conn, self.authkey)
+            conn.send(('pipe', self.code))
+        except:
+            conn.close()
+            raise
+        self.conn = conn
+    def close(self):
+        if self.conn: self.conn.close()
+        self.conn = None
+    def fileno(self): return self.conn.fileno()
+    def send(self, msg): self.conn.send(msg)
+    def recv(self): return self.conn.recv()
+
+def _checkAddress(address):
+    "Allow only Unix sockets and TCP addresses of localhost: messages are unpickled without authentication."
+    if isstring(address): return
+    host = address[0]
+    try: ip = socket.gethostbyname(host) if host else None
+    except socket.error: ip = None
+    if not (ip and ip.startswith('127.')):
+        raise Exception("Remote, only Unix sockets and TCP addresses of localhost (127.x.x.x) are allowed, not %s" % (address,))
+
+def _listen(address, authkey):
+    _checkAddress(address)
+    if isstring(address) and os.path.exists(address): os.remove(address)
+    listener = Listener(address, authkey = authkey)             # TCP listeners are created with SO_REUSEADDR
+    if isstring(address): os.chmod(address, 0600)             # only the owner can connect
+    return listener
+
+def _spawnedWorker(address, authkey, ready):
+    "Body of a worker process started by Remote.spawn(): report the actual address through 'ready' once bound, then serve."
+    listener = _listen(address, authkey)
+    ready.send(listener.address)
+    ready.close()
+    _serveRemote(listener)
+
+def _serveRemote(listener):
+    """Main loop of a Remote worker. Serves authenticated clients one by one. Incoming messages are read by a separate thread, 
+    so that the client can always send its chunks, even when the worker is blocked on sending results back."""
+    global _workerPipe
+    from nifty.data import dast
+    while True:
+        try: conn = listener.accept()
+        except (AuthenticationError, IOError, EOFError): continue           # unauthenticated or broken client
+        inbox = Queue()
+        def receive(conn, inbox):
+            try:
+                while True: inbox.put(conn.recv())
+            except (IOError, EOFError): inbox.put(None)
+        reader = threading.Thread(target = receive, args = (conn, inbox))
+        reader.daemon = True
+        reader.start()
+        error = None            # formatted traceback of a failed setup of the pipe; reported back with every chunk
+        try:
+            while True:
+                msg = inbox.get()
+                if msg is None: break
+                if msg[0] == 'pipe':
+                    try:
+                        _workerPipe = dast.decode1(msg[1])
+                        _workerPipe._prolog()
+                        error = None
+                    except Exception:
+                        error = traceback.format_exc()
+                else:
+                    _, index, start, items = msg
+                    res = (None, len(items), error) if error else _processChunk((start, items))
+                    conn.send((index,) + res)
+        except IOError: pass
+        finally: conn.close()
+
 
 #####################################################################################################################################################
 
+def _batches(source, maxsize):
+    "Iterate over 'source' in batches. Use source's __batch_iter__ if available, otherwise group consecutive items into lists."
+    if isinstance(source, (Pipe, _Probe)):
+        for batch in source.__batch_iter__(maxsize): yield batch
+        return
+    source = iter(source)
+    while True:
+        batch = list(islice(source, maxsize))
+        if not batch: return
+        yield batch
+
 def _normalize(pipes):
     """Normalize a given list of pipes. Remove None's and strings (used for commenting out), 
     instantiate Pipe classes if passed instead of an instance, wrap up functions, collections and files."""
@@ -1809,10 +3828,35 @@ def _normalize(pipes):
     return filter(None, map(convert, pipes))
 
 
+#####################################################################################################################################################
+
+def _benchFreeze(n = 2000, widths = (1, 10, 50)):
+    """Benchmark of Grid(copyData='freeze') vs copyData=True: throughput of 'n' dict records passed in one scan 
+    to 'width' parallel runs of a Mean pipe, in threads. Run with: python -m nifty.data.pipes bench"""
+    records = [{'id': i, 'tags': ['tag%d' % j for j in xrange(15)], 'meta': {'score': i % 7, 'date': (2015, 1, 1 + i % 28)}} 
+               for i in xrange(n)]
+    print "  width   copyData=True   copyData='freeze'   (items/s)"
+    for width in widths:
+        speed = []
+        for copyData in (True, 'freeze'):
+            grid = Grid(Mean(fun = lambda r: r['meta']['score']), maxThreads = None, copyData = copyData, title = map(str, range(width)))
+            stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')          # silence reports of individual runs
+            try:
+                start = time()
+                Collection(records) >> grid >> RUN
+                speed.append(n / (time() - start))
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+        print "  %5d   %13.0f   %17.0f" % (width, speed[0], speed[1])
+
+
 #####################################################################################################################################################
 
 if __name__ == "__main__":
-    import doctest
-    print doctest.testmod()
+    if sys.argv[1:] == ['bench']: _benchFreeze()
+    else:
+        import doctest
+        print doctest.testmod()
 
     
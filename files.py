@@ -13,11 +13,13 @@ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
 You should have received a copy of the GNU General Public License along with Nifty. If not, see <http://www.gnu.org/licenses/>.
 '''
 
-import os, shutil, jsonpickle
+import os, sys, shutil, threading, jsonpickle, cPickle as pickle
 from copy import deepcopy
 from itertools import count
+from time import time
+from Queue import Queue, Empty
 
-from nifty.util import classname, fileexists, filesize
+from nifty.util import classname, fileexists, filesize, NoneLock
 from nifty.data.dast import DAST
 
 
@@ -216,6 +218,11 @@ class File(GenericFile):
         self.file.write(s)
     def flush(self):
         self.file.flush()
+    def seek(self, pos):
+        self.file.seek(pos)
+    def tell(self):
+        "Position in the underlying file. Not reliable during iteration, because of the file's read-ahead buffering."
+        return self.file.tell()
         
     def readchars(self):
         "In the future, this method will read characters in Unicode-aware - or other (en)coding-aware - way. Encoding will be specified as a file parameter."
@@ -272,6 +279,161 @@ class SafeRewriteFile(File):
         if self.realname != self.basename:
             os.rename(self.realname, self.basename)
 
+class GroupFile(File):
+    """File for fast sequential writing with "group commit": write() only appends strings to an in-memory batch, 
+    and full batches of 'batch' bytes are written to disk by a background thread, with one write call per batch,
+    so the caller doesn't wait for the disk. Memory usage is bounded: at most 'queue' full batches can wait for the writer,
+    after that write() blocks until the disk catches up. flush() passes the current (incomplete) batch to the writer 
+    without waiting for it to be written; close() waits until all data are written.
+    Durability is optional: if 'synctime' (seconds) or 'syncbytes' is given, the writer calls os.fsync() after that much 
+    time or that many bytes written since the previous fsync, and at close(). With 'synctime', the writer also takes over 
+    an incomplete batch that's older than 'synctime', even if the caller stopped writing, so no data stay in memory 
+    for much longer than that:
+    
+    >>> import tempfile; from time import sleep; name = tempfile.mktemp()
+    >>> f = GroupFile(name, mode = 'w', synctime = 0.1)
+    >>> f.write('x' * 100)
+    >>> sleep(0.5); os.path.getsize(name)
+    100
+    >>> f.close(); os.remove(name)
+    
+    An exception raised in the writer thread is re-raised in the caller by every subsequent write(), flush() and close().
+    Can be used in write modes only ('w' or 'a').
+    """
+    
+    def __init__(self, name, batch = 1 << 20, queue = 4, synctime = None, syncbytes = None, **kwargs):
+        self.batch = batch
+        self.queue = queue
+        self.synctime = synctime
+        self.syncbytes = syncbytes
+        super(GroupFile, self).__init__(name, **kwargs)
+    
+    def _open(self):
+        super(GroupFile, self)._open()
+        self.buffer = []                        # strings of the current batch
+        self.size = 0                           # no. of bytes in self.buffer
+        self.position = self.file.tell()       # no. of bytes written so far, including the ones not yet passed to the writer
+        self.started = None                     # when the 1st string of the current batch was written
+        self.error = None                       # exc_info() of an exception raised in the writer thread
+        self.writer = None                      # the writer thread and its queue of batches, started on the 1st write
+        self.batches = None
+        self.lock = threading.Lock() if self.synctime is not None else NoneLock()      # guards the current batch, which can be taken over by the writer
+        
+    def _close(self):
+        """Wait until all data are written, then close the file. If the writer failed, only the file handle is closed, 
+        without finalizing the file in subclasses (no rename in SafeRewriteGroupFile), and the error is re-raised."""
+        try: self._commit()
+        finally:
+            if self.writer:
+                self.batches.put(None)
+                self.writer.join()
+            self.writer = self.batches = None
+            if self.error: File._close(self)
+        self._check()
+        super(GroupFile, self)._close()
+    
+    def write(self, s):
+        if self.writer is None: self._start()
+        with self.lock:
+            if not self.buffer: self.started = time()
+            self.buffer.append(s)
+            self.size += len(s)
+        self.position += len(s)
+        if self.size >= self.batch or (self.synctime is not None and time() - self.started >= self.synctime): self._commit()
+    
+    def flush(self):
+        self._commit()
+    
+    def tell(self):
+        return self.position
+    
+    def _start(self):
+        "Start the writer thread. The queue and the file are passed as arguments, so that the thread never touches a reopened file."
+        self.batches = Queue(self.queue)
+        self.writer = threading.Thread(target = self._writer, args = (self.file, self.batches))
+        self.writer.daemon = True
+        self.writer.start()
+    
+    def _commit(self):
+        "Pass the current batch to the writer thread."
+        self._check()
+        data = self._take()
+        if data:
+            if self.writer is None: self._start()
+            self.batches.put(data)
+    
+    def _take(self):
+        "Remove the current batch and return it as a string."
+        with self.lock:
+            data = ''.join(self.buffer)
+            self.buffer = []
+            self.size = 0
+        return data
+    
+    def _takeAged(self, batches):
+        "Called by the writer when idle: take over the current batch of the caller if it's older than 'synctime'. Empty string if nothing to take."
+        with self.lock:
+            if not self.buffer or not batches.empty() or time() - self.started < self.synctime: return ''       # batches already queued must be written first
+            data = ''.join(self.buffer)
+            self.buffer = []
+            self.size = 0
+        return data
+    
+    def _check(self):
+        if self.error: raise self.error[0], self.error[1], self.error[2]
+    
+    def _writer(self, f, batches):
+        "Main loop of the writer thread."
+        unsynced = 0
+        synced = time()
+        sync = self.synctime is not None or self.syncbytes is not None
+        while True:
+            if self.synctime is None: data = batches.get()
+            else:
+                try: data = batches.get(timeout = self.synctime)
+                except Empty: data = self._takeAged(batches)            # the caller is idle? take over its batch if it's old enough
+            if self.error: 
+                if data is None: return
+                continue                                # after an error, remaining batches are dropped
+            try:
+                if data is None:
+                    f.flush()
+                    if sync and unsynced: os.fsync(f.fileno())
+                    return
+                if data:
+                    f.write(data)
+                    f.flush()
+                    unsynced += len(data)
+                if unsynced and ((self.syncbytes is not None and unsynced >= self.syncbytes) or (self.synctime is not None and time() - synced >= self.synctime)):
+                    os.fsync(f.fileno())
+                    unsynced = 0
+                    synced = time()
+            except Exception:
+                self.error = sys.exc_info()
+                if data is None: return
+
+class SafeRewriteGroupFile(GroupFile, SafeRewriteFile):
+    """GroupFile with safe rewrite of SafeRewriteFile: the data are written to a *.rewrite file, which replaces the original file at close().
+    If the writer thread fails, the original file is preserved:
+    
+    >>> import tempfile; name = tempfile.mktemp()
+    >>> open(name, 'w').write('ORIGINAL')
+    >>> class DiskFull(object):
+    ...     def write(self, data): raise IOError("disk full")
+    ...     def flush(self): pass
+    >>> class FailingFile(SafeRewriteGroupFile):
+    ...     def _writer(self, f, batches): SafeRewriteGroupFile._writer(self, DiskFull(), batches)
+    >>> f = FailingFile(name, mode = 'w')
+    >>> f.write('NEW DATA')
+    >>> f.close()
+    Traceback (most recent call last):
+    IOError: disk full
+    >>> open(name).read()
+    'ORIGINAL'
+    >>> os.remove(name); os.remove(name + SafeRewriteFile.EXT)
+    """
+
+
 #####################################################################################################################################################
 
 class FileWrapper(GenericFile):
@@ -309,7 +471,11 @@ class FileWrapper(GenericFile):
 class ObjectFile(FileWrapper):
     """File with a list of serialized objects, written and read 1 at a time using a predefined serialization method,
     implemented by subclasses in _read and _write methods. 
-    In read access, entire object can be used as an iterator, or read() can be called, which behaves like iterator's next() method."""
+    In read access, entire object can be used as an iterator, or read() can be called, which behaves like iterator's next() method.
+    During reading, tell() returns the raw position of the beginning of the next object, which can be passed later on
+    to seek() to resume reading from this point without parsing the preceding objects."""
+
+    offset = 0              # in read mode: raw position in the underlying file of the beginning of the next object to be read
 
     def __init__(self, name, cls = None, flush = 0, emptylines = 0, **kwargs):
         """
@@ -332,6 +498,16 @@ class ObjectFile(FileWrapper):
 #         else:
 #             self.file = self.basespace.open(self.filename, mode = self.mode)
         self.flushcount = self.flushfreq
+        self.offset = 0
+    
+    def tell(self):
+        if 'r' in self.mode: return self.offset
+        return self.file.tell()
+    
+    def seek(self, pos):
+        "Move to a position returned earlier by tell(). The next object will be read or written starting at this position."
+        self.file.seek(pos)
+        self.offset = pos
     
     def write(self, item):
         self._write(item)
@@ -357,9 +533,12 @@ class JsonFile(ObjectFile):
         self.file.write(jsonpickle.encode(item) + "\n\n")
     def _read(self):
         "Generator that reads from an already-open self.file."
-        for line in self.file:
+        lines = _Lines(self.file, self.offset)
+        for line in lines:
             if not line.strip(): continue
-            yield jsonpickle.decode(line)
+            item = jsonpickle.decode(line)
+            self.offset = lines.end
+            yield item
             
 class DastFile(ObjectFile):
     def __init__(self, filename, mode = 'r', cls = File, flush = 0, emptylines = 0, **dastArgs):
@@ -370,14 +549,67 @@ class DastFile(ObjectFile):
         self.dast.dump(item, self.file, newline = True)
         
     def _read(self):
-        return self.dast.decode(self.file.file)
+        lines = _Lines(self.file.file, self.offset)
+        for item in self.dast.decode(lines):
+            self.offset = lines.start           # the decoder reads 1 line ahead, which is the 1st line of the next object
+            yield item
         #raise NotImplemented()
         #for item in []: yield item
+
+class PickleFile(ObjectFile):
+    """Binary file of pickled objects. Fast and compact, but not human-readable and Python-specific, 
+    so it's best suited for temporary data, like caches. Open in binary mode: 'rb', 'wb' or 'ab'."""
+    def __init__(self, filename, mode = 'rb', cls = File, flush = 0):
+        super(PickleFile, self).__init__(filename, cls, flush, mode = mode)
+
+    def _write(self, item):
+        self.file.write(pickle.dumps(item, pickle.HIGHEST_PROTOCOL))
+        
+    def _read(self):
+        f = self.file.file
+        while True:
+            try: item = pickle.load(f)
+            except EOFError: return
+            self.offset = f.tell()
+            yield item
+
+class _Lines(object):
+    """Iterator over lines of a file that tracks raw positions: 'start' and 'end' of the line returned most recently,
+    or start=end=EOF position after the last line. Used by ObjectFiles to track positions of objects, 
+    which can't be done with file.tell() during iteration, because of read-ahead buffering."""
+    def __init__(self, lines, offset = 0):
+        self.lines = iter(lines)
+        self.start = self.end = offset
+    def __iter__(self):
+        return self
+    def next(self):
+        try: line = self.lines.next()
+        except StopIteration:
+            self.start = self.end
+            raise
+        self.start = self.end
+        self.end += len(line)
+        return line
     
             
 class PagedFile(GenericFile):
     """Logical object file partitioned into a number of separate files (pages), named *.1, *.2, ... 
-    (TODO:) On write, new part is created after size threshold is reached."""
+    (TODO:) On write, new part is created after size threshold is reached.
+    During reading, tell() returns the position of the next object, which can be passed to seek() to resume reading:
+    
+    >>> import tempfile; folder = tempfile.mkdtemp()
+    >>> for page in (1, 2): open(os.path.join(folder, 'data.%d' % page), 'w').writelines('page %d line %d\\n' % (page, i) for i in xrange(2000))
+    >>> f = PagedFile(os.path.join(folder, 'data.%s'), stop = 2)
+    >>> items = iter(f); lines = [items.next() for i in xrange(10)]
+    >>> pos = f.tell(); items.close(); f.close()
+    >>> os.path.basename(pos[0]), pos[1]
+    ('data.1', 140)
+    >>> f = PagedFile(os.path.join(folder, 'data.%s'), stop = 2)
+    >>> f.seek(pos); lines = list(f)
+    >>> lines[0], len(lines)
+    ('page 1 line 10\\n', 3990)
+    >>> f.close(); shutil.rmtree(folder)
+    """
     
     new  = "new"        # name to be used for the new page (not yet completed) during write; when done, renamed to its ultimate name
     last = "new"        # name of the last file to be tried during reading, when no more regular IDs are present; None if nothing more should be tried
@@ -396,11 +628,12 @@ class PagedFile(GenericFile):
     def _open(self):
         "Invariant of an open file: self.file holds the current page file to be read from, or None if no more pages to be read."
         self.pages = iter(self.ids) if self.ids != None \
-                     else xrange(self.start, self.stop+1) if self.stop != None \
+                     else iter(xrange(self.start, self.stop+1)) if self.stop != None \
                      else count(self.start)
         self.infinite = isinstance(self.pages, count)   # iterating over infinite range of pages? missing page allowed after 1st one
         self.file = None                                # base file with the current page
         self.filename = None
+        self.lines = None                               # _Lines iterator over the current page, if it's a raw File being read
         self.openNext()                                 # open 1st page
         
     def _close(self):
@@ -412,13 +645,32 @@ class PagedFile(GenericFile):
         while True:
             if not self.file: break                         # we're at the end of data, no more page file to read
             assert not self.file.closed
-            for item in self.file: yield item
+            if isinstance(self.file, File):             # raw lines: positions must be tracked here, file.tell() is unreliable during iteration
+                self.lines = _Lines(self.file.file, self.file.tell())
+                for item in self.lines: yield item
+            else:                                       # object files track positions of their objects by themselves
+                for item in self.file: yield item
             assert not self.file.closed
             if not self.openNext(): break
 
+    def tell(self):
+        "Position of the next object to be read: a pair (name of the current page, position inside the page); (None, None) at the end of data."
+        if not self.file: return None, None
+        if self.lines: return self.filename, self.lines.end
+        return self.filename, self.file.tell()
+    
+    def seek(self, pos):
+        "Move to a position returned by tell(). Pages preceding the given one are skipped without reading."
+        filename, offset = pos
+        self.lines = None
+        while self.file and self.filename != filename:
+            if not self.openNext(): break
+        if self.file and offset: self.file.seek(offset)
+    
     def openNext(self):
         "Close the current page and open the next one. Return True if succeeded, False if no more pages, exception when no pages present at all."
         first = True
+        self.lines = None
         if self.file:
             self.file.close()
             self.file = None
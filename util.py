@@ -14,7 +14,7 @@ You should have received a copy of the GNU General Public License along with Nif
 
 from __future__ import absolute_import
 import __builtin__, os, sys, glob, types as _types, re, numbers, json, time, datetime, calendar
-import logging, random, math, collections, unicodedata, heapq, threading, inspect
+import logging, random, math, collections, unicodedata, heapq, threading, inspect, copy
 
 
 #####################################################################################################################################################
@@ -248,6 +248,109 @@ class ObjDict(dict):
         if name.startswith('__'): raise AttributeError(name)
         del self[name]
 
+def _immutable(self, *args, **kwargs):
+    raise TypeError("%s object is frozen and can't be modified" % classname(self))
+
+class FrozenDict(dict):
+    "A dict that raises TypeError on any attempt of modification. Created by freeze()."
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+    def __reduce__(self): return freeze, (dict(self),)           # unpickling would call __setitem__, thus freeze a plain dict instead
+
+class FrozenList(list):
+    "A list that raises TypeError on any attempt of modification. Created by freeze()."
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = \
+        append = extend = insert = pop = remove = reverse = sort = _immutable
+    def __reduce__(self): return freeze, (list(self),)
+
+_frozenClasses = {}
+
+def _frozenclass(cls):
+    "Subclass of 'cls' with all modifying methods (of objects, dicts, lists) replaced with _immutable(). Cached."
+    frozen = _frozenClasses.get(cls)
+    if frozen is None:
+        methods = ['__setattr__', '__delattr__']
+        if issubclass(cls, dict): methods += "__setitem__ __delitem__ clear pop popitem setdefault update".split()
+        if issubclass(cls, list): methods += "__setitem__ __delitem__ __setslice__ __delslice__ __iadd__ __imul__ " \
+                                             "append extend insert pop remove reverse sort".split()
+        attrs = dict.fromkeys(methods, _immutable)
+        attrs['__reduce__'] = _reduceFrozen
+        frozen = type(cls)('Frozen' + cls.__name__, (cls,), attrs)
+        _frozenClasses[cls] = frozen
+    return frozen
+
+def _reduceFrozen(self):
+    """__reduce__() of classes created by _frozenclass(). They're dynamic and can't be pickled by reference,
+    so the object is pickled as an instance of its original class and frozen again upon unpickling."""
+    cls = type(self).__bases__[0]
+    items = dict(self) if isinstance(self, dict) else list(self) if isinstance(self, list) else None
+    return _unfrozen, (cls, items, getattr(self, '__dict__', None))
+
+def _unfrozen(cls, items, state):
+    "Recreate a frozen object of class _frozenclass(cls), from its items (for dict/list subclasses) and __dict__. See _reduceFrozen()."
+    obj = cls.__new__(cls)
+    if isinstance(obj, dict): dict.update(obj, items)
+    elif isinstance(obj, list): list.extend(obj, items)
+    if state: obj.__dict__.update(state)
+    return freeze(obj)
+
+_atomic = (int, long, float, complex, bool, basestring, type(None), datetime.date, datetime.time, datetime.timedelta, type)
+
+def freeze(obj):
+    """Deep read-only copy of 'obj', which can be safely shared between multiple consumers (e.g., threads)
+    without copying: any attempt of modification raises TypeError.
+    Atomic values are returned as they are; lists and dicts are converted to FrozenList and FrozenDict, tuples and sets
+    to tuples and frozensets of frozen items; NumPy arrays to read-only views; subclasses of dict and list,
+    and other objects having __dict__, to instances of dynamically created subclasses of their original classes
+    that block attribute assignment (isinstance() checks still work). Other types raise TypeError.
+    >>> d = freeze({'x': [1, 2], 'y': (3, {4})})
+    >>> d['x'].append(5)
+    Traceback (most recent call last):
+        ...
+    TypeError: FrozenList object is frozen and can't be modified
+    >>> d == {'x': [1, 2], 'y': (3, {4})}
+    True
+    
+    Frozen objects can be pickled; they're frozen again when unpickled:
+    >>> import cPickle
+    >>> o = cPickle.loads(cPickle.dumps(freeze(Object(tags = ['a'])), 2))
+    >>> o.tags, classname(o)
+    (['a'], 'FrozenObject')
+    >>> o.tags.append('b')
+    Traceback (most recent call last):
+        ...
+    TypeError: FrozenList object is frozen and can't be modified
+    """
+    t = type(obj)
+    if t in (int, float, str, unicode, bool, type(None), FrozenDict, FrozenList, frozenset) or isinstance(obj, _atomic): return obj
+    if t is dict: return FrozenDict((k, freeze(v)) for k, v in obj.iteritems())
+    if t is list: return FrozenList(freeze(v) for v in obj)
+    if t is tuple: return tuple(freeze(v) for v in obj)
+    if t is set or t is frozenset: return frozenset(obj)          # elements of a set are hashable, thus typically immutable already
+
+    np = sys.modules.get('numpy')
+    if np is not None:
+        if isinstance(obj, np.generic): return obj
+        if isinstance(obj, np.ndarray):
+            view = obj.view()
+            view.flags.writeable = False
+            return view
+
+    if t in _frozenClasses.values(): return obj
+    if isinstance(obj, dict) or isinstance(obj, list) or hasattr(obj, '__dict__'):
+        try: frozen = _frozenclass(t)
+        except TypeError: frozen = None
+        if frozen is not None:
+            dup = copy.copy(obj)
+            if isinstance(obj, dict):                           # for dict/list subclasses, only items are frozen, not attributes (internal state)
+                for k, v in obj.iteritems(): dup[k] = freeze(v)
+            elif isinstance(obj, list):
+                dup[:] = [freeze(v) for v in obj]
+            else:
+                object.__setattr__(dup, '__dict__', dict((k, freeze(v)) for k, v in obj.__dict__.iteritems()))
+            object.__setattr__(dup, '__class__', frozen)
+            return dup
+    raise TypeError("freeze(), can't make a read-only copy of an object of type %s" % classname(obj, full = True))
+
 class ComparableMixin:
     "Base class (mixin) that implements all comparison operators in terms of __lt__()."
     def __eq__(self, other):